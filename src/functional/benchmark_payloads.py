@@ -0,0 +1,70 @@
+import time
+import argparse
+
+import numpy as np
+
+from dhruva_models import DhruvaRESTModel
+from dhruva_models.payload_template import dumps
+from constants import Enums
+
+
+def synthetic_batch(task: str, batch_size: int, audio_seconds: float):
+    rng = np.random.default_rng(0)
+    if task == Enums.tasks.ASR:
+        return "audio", [
+            {"audio": {"array": rng.uniform(-0.5, 0.5, int(16000 * audio_seconds)), "sampling_rate": 16000}}
+            for _ in range(batch_size)
+        ]
+    words = ["भारत", "एक", "विशाल", "देश", "है", "जहाँ", "अनेक", "भाषाएँ", "बोली", "जाती", "हैं"]
+    if task == Enums.tasks.Transliteration:
+        return "word", [{"word": words[i % len(words)]} for i in range(batch_size)]
+    return "sentence", [{"sentence": " ".join(rng.choice(words, 25))} for _ in range(batch_size)]
+
+
+def synthetic_response(task: str, batch_size: int) -> bytes:
+    if task == Enums.tasks.ASR:
+        return dumps({"output": [{"source": "नमस्ते " * 40} for _ in range(batch_size)]})
+    if task == Enums.tasks.Transliteration:
+        return dumps({"output": [{"source": "bharat", "target": ["भारत"]} for _ in range(batch_size)]})
+    return dumps({"output": [{"source": "source " * 25, "target": "लक्ष्य " * 25} for _ in range(batch_size)]})
+
+
+def benchmark(task: str, full_validation: bool, batch_size: int, iterations: int, audio_seconds: float):
+    input_column, batch = synthetic_batch(task, batch_size, audio_seconds)
+    response = synthetic_response(task, batch_size)
+    model = DhruvaRESTModel(
+        task=task,
+        url="http://localhost",
+        input_column=input_column,
+        api_key="",
+        source_language="hi",
+        target_language="en",
+        full_validation=full_validation,
+    )
+
+    num_bytes = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        body = model._serialize_payload(model._generate_payload(batch))
+        model._parse_response(response)
+        num_bytes += len(body) + len(response)
+    elapsed = time.perf_counter() - start
+    return num_bytes / elapsed, iterations / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Request / response serialisation throughput per task")
+    parser.add_argument("--tasks", nargs="+", default=[Enums.tasks.ASR, Enums.tasks.NMT, Enums.tasks.Transliteration])
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--audio_seconds", type=float, default=8.0)
+    args = parser.parse_args()
+
+    print(f"{'task':<16}{'mode':<12}{'MB/s':>10}{'batches/s':>12}")
+    for task in args.tasks:
+        for full_validation in (True, False):
+            bytes_per_second, batches_per_second = benchmark(
+                task, full_validation, args.batch_size, args.iterations, args.audio_seconds
+            )
+            mode = "validated" if full_validation else "fast"
+            print(f"{task:<16}{mode:<12}{bytes_per_second / 1e6:>10.1f}{batches_per_second:>12.1f}")
@@ -61,10 +61,82 @@ class _Task(BaseModel):
     metric: str
 
 
+class _Batching(BaseModel):
+    adaptive: bool = True
+    initial_size: int = 2
+    min_size: int = 1
+    max_size: int = 64
+    # Mean request latency divided by batch size, in milliseconds
+    latency_slo_ms: float = 500.0
+    max_error_rate: float = 0.05
+    # Number of batches observed at a size before it is grown
+    window: int = 4
+    # Timeouts / 5xx / 413 within one window after which the size is no longer grown to
+    overload_limit: int = 2
+    # Error-free windows after which that limit is lifted again
+    ceiling_windows: int = 8
+    # Batch items of similar audio duration / token count together, within windows of bucket_window items
+    bucket_by_length: bool = True
+    bucket_window: int = 256
+
+
+class _Cache(BaseModel):
+    # read: reuse stored responses, write: refresh them, off: bypass the cache
+    mode: str = "off"
+    path: str = ".cache/dhruva_responses.sqlite"
+    ttl_seconds: Optional[float]
+    max_entries: Optional[int]
+
+
+class _Retry(BaseModel):
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    # Per-request timeout in seconds; timed out batches are retried item by item at the end
+    timeout: float = 90.0
+    final_pass: bool = True
+
+
+class _Hedging(BaseModel):
+    enabled: bool = False
+    # A request still running after this percentile of recent latencies is sent once more
+    percentile: float = 95
+    # Hedges allowed, as a fraction of the requests sent
+    budget: float = 0.05
+    min_samples: int = 20
+
+
+class _Streaming(BaseModel):
+    # Length of the audio slices sent over the socket
+    chunk_ms: int = 2000
+    # Speed relative to real time: 1 for real time, 4 for four times faster, null for no pacing
+    pacing: Optional[float] = 1.0
+    # Keep one socket session per endpoint open across utterances
+    reuse_session: bool = False
+
+
 class _Model(BaseModel):
     type: str
-    url: str
+    # One URL, or several replicas of the same service to spread requests over
+    url: Union[str, list[str]]
+    # round_robin, least_outstanding or latency_weighted, when several URLs are given
+    routing: str = "round_robin"
     service_id: Optional[str]
+    engine: str = "process"
+    max_in_flight: int = 8
+    pool_size: int = 10
+    # Items per unit of work pulled by an idle worker of the process engine
+    chunk_size: int = 64
+    batching: _Batching = _Batching()
+    cache: _Cache = _Cache()
+    retry: _Retry = _Retry()
+    hedging: _Hedging = _Hedging()
+    streaming: _Streaming = _Streaming()
+    # Requests per second across all workers, unlimited when unset
+    max_rps: Optional[float]
+    burst: int = 1
+    # Validate every request and response through the pydantic schemas
+    full_validation: bool = False
 
 
 class _Dataset(BaseModel):
@@ -76,6 +148,7 @@ class _Dataset(BaseModel):
     label_column: Optional[Union[list[str], str]]
     split: str
     subset: Optional[Union[list[str], str]]
+    streaming: bool = False
 
 
 class UserConfiguration(PydanticBaseSettings):
@@ -85,6 +158,8 @@ class UserConfiguration(PydanticBaseSettings):
     task: _Task
     dataset: Union[list[_Dataset], _Dataset]
     results_folder: str = "./results"
+    # Subsets / language pairs evaluated at the same time
+    max_concurrent_subsets: int = 1
 
     class Config:
         config_files = [Path("test-nmt.yml")]
@@ -1,11 +1,14 @@
 import os
+import re
 import json
 import yaml
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from datasets import load_dataset
+from datasets import load_dataset, load_dataset_builder
 
-from dhruva_models import DhruvaRESTModel, DhruvaSocketModel
+from dhruva_models import DhruvaRESTModel, DhruvaSocketModel, InferenceRuntime
 from dhruva_evaluators import DhruvaASREvaluator, DhruvaMTEvaluator, DhruvaTTSEvaluator, DhruvaTransliterationEvaluator
 from constants import (
     Enums,
@@ -26,6 +29,9 @@ TASK_EVALUATOR_MAPPING = {
 
 MODEL_TYPE_MODEL_MAPPING = {Enums.model_type.REST: DhruvaRESTModel, Enums.model_type.STREAMING: DhruvaSocketModel}
 
+# Configs holding every language of a multilingual dataset, loaded once and shared by all of its pairs
+SHARED_DATASET_CONFIGS = {Enums.datasets.FLORES: "all"}
+
 
 def parse_yaml_file(yaml_file_path):
     """Load the YAML file contents into a dictionary"""
@@ -36,11 +42,64 @@ def parse_yaml_file(yaml_file_path):
     return yaml_data
 
 
+def _checkpoint_key(*parts) -> str:
+    """Single directory name for a (dataset path, dataset name, split, subset), e.g. ai4bharat_MUCS__MUCS__test__hi"""
+    return "__".join(re.sub(r"[^\w.-]+", "_", str(part)).strip("_") for part in parts if part is not None)
+
+
+class SharedDatasets:
+    """
+    Splits loaded once per suite and shared by its subsets. The loaded splits are memory-mapped
+    from the datasets cache, and every subset gets a view with only its own columns, so the Hub
+    and the cache are only resolved once per dataset.
+    """
+
+    def __init__(self):
+        self._datasets = {}
+        # One lock per split, so concurrent subsets only wait for the split they need
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # Example counts of the splits from the dataset metadata, by the same keys
+        self._num_examples = {}
+
+    def num_examples(self, dataset_path, dataset_name, subset, split) -> int:
+        """Rows of the split a subset reads, without downloading it. 0 when unknown."""
+        config = SHARED_DATASET_CONFIGS.get(dataset_name, subset)
+        key = (dataset_path, config, split)
+        if key in self._datasets:
+            return len(self._datasets[key])
+        if key not in self._num_examples:
+            try:
+                split_info = load_dataset_builder(dataset_path, config).info.splits[split]
+                self._num_examples[key] = split_info.num_examples or 0
+            except Exception:
+                self._num_examples[key] = 0
+        return self._num_examples[key]
+
+    def get(self, dataset_path, dataset_name, subset, split, columns):
+        config = SHARED_DATASET_CONFIGS.get(dataset_name, subset)
+        key = (dataset_path, config, split)
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._datasets:
+                logger.info(f"Loading {dataset_path} ({config}, {split}) for all of its subsets")
+                self._datasets[key] = load_dataset(dataset_path, name=config, split=split)
+        dataset = self._datasets[key]
+        if config == subset:
+            return dataset
+        # Column view of the pair, sharing the same Arrow table
+        return dataset.remove_columns([column for column in dataset.column_names if column not in columns])
+
+
 class Evaluation:
     """Run evaluation on a single subset and single model"""
 
-    def __init__(self, user_config):
+    def __init__(self, user_config, resume=False, runtime=None, shared_datasets=None):
         self.user_config = user_config
+        self.resume = resume
+        self.runtime = runtime
+        self.shared_datasets = shared_datasets
         self.task_evaluator_obj = TASK_EVALUATOR_MAPPING.get(self.user_config.task.type)
         self.model = MODEL_TYPE_MODEL_MAPPING.get(self.user_config.model.type.lower())
 
@@ -97,7 +156,16 @@ class Evaluation:
         self.label_column, dataset_target_lang = self.get_label_column_for_dataset(target_language, dataset_name)
         self.subset = self.find_data_subset(dataset_source_lang, dataset_target_lang)
 
-    def run(self, dataset_path, dataset_name, split, source_language, target_language):
+    def estimate_cost(self, dataset_path, dataset_name, split):
+        """Number of items of the subset's split, without downloading it. 0 when unknown."""
+        if self.shared_datasets is not None:
+            return self.shared_datasets.num_examples(dataset_path, dataset_name, self.subset, split)
+        try:
+            return load_dataset_builder(dataset_path, self.subset).info.splits[split].num_examples or 0
+        except Exception:
+            return 0
+
+    def run(self, dataset_path, dataset_name, split, source_language, target_language, streaming=False):
         self.task_evaluator = self.task_evaluator_obj(
             dataset_name=dataset_name,
             source_language=source_language,
@@ -105,23 +173,52 @@ class Evaluation:
             task=self.user_config.task.type,
             default_metric_name=self.user_config.task.metric,
         )
+        self.task_evaluator.streaming = streaming
+        # Subsets are often just a language code, shared by several datasets of one config
+        run_key = _checkpoint_key(dataset_path, dataset_name, split, self.subset)
+        model = self.model(
+            url=self.user_config.model.url,
+            service_id=self.user_config.model.service_id,
+            task=self.user_config.task.type,
+            input_column=self.input_column,
+            api_key=EnvSettings.api_key,
+            source_language=source_language,
+            target_language=target_language,
+            engine=self.user_config.model.engine,
+            max_in_flight=self.user_config.model.max_in_flight,
+            pool_size=self.user_config.model.pool_size,
+            chunk_size=self.user_config.model.chunk_size,
+            batching=self.user_config.model.batching.dict(),
+            cache=self.user_config.model.cache.dict(),
+            retry=self.user_config.model.retry.dict(),
+            hedging=self.user_config.model.hedging.dict(),
+            streaming=self.user_config.model.streaming.dict(),
+            max_rps=self.user_config.model.max_rps,
+            burst=self.user_config.model.burst,
+            full_validation=self.user_config.model.full_validation,
+            routing=self.user_config.model.routing,
+            checkpoint_dir=os.path.join(self.user_config.results_folder, "checkpoints", run_key),
+            errors_path=os.path.join(self.user_config.results_folder, "errors", run_key + ".csv"),
+            resume=self.resume,
+            runtime=self.runtime,
+        )
+        data, subset, data_split = dataset_path, self.subset, split
+        if self.shared_datasets is not None and not streaming:
+            columns = (self.input_column, self.label_column)
+            data = self.shared_datasets.get(dataset_path, dataset_name, self.subset, split, columns)
+            # Already resolved, the evaluator takes the loaded split as is
+            subset, data_split = None, None
         results = self.task_evaluator.compute(
-            model_or_pipeline=self.model(
-                url=self.user_config.model.url,
-                service_id=self.user_config.model.service_id,
-                task=self.user_config.task.type,
-                input_column=self.input_column,
-                api_key=EnvSettings.api_key,
-                source_language=source_language,
-                target_language=target_language,
-            ),
-            data=dataset_path,
-            subset=self.subset,
-            split=split,
+            model_or_pipeline=model,
+            data=data,
+            subset=subset,
+            split=data_split,
             input_column=self.input_column,
             label_column=self.label_column,
             metric=self.user_config.task.metric,
         )
+        results["inference"] = model.stats.to_dict()
+        results["failed_items"] = model.stats.failed_items
 
         logger.warning(f"\n\nResults:\n{json.dumps(results, indent=4)}\n\n\n")
         with open(os.path.join(self.user_config.results_folder, self.subset + ".json"), "w") as f:
@@ -131,10 +228,27 @@ class Evaluation:
 class EvaluationSuite:
     """Evaluation Suite to run evaluations on multiple subsets of a dataset in one shot"""
 
-    def __init__(self, config_path):
+    def __init__(self, config_path, cache_mode=None, resume=False):
         self.user_config = UserConfiguration.parse_obj(parse_yaml_file(config_path))
+        if cache_mode is not None:
+            self.user_config.model.cache.mode = cache_mode
         logger.warning(f"\n\nUser Config:\n{json.dumps(self.user_config.dict(), indent=4)}\n\n")
-        self.evaluator = Evaluation(self.user_config)
+        # Rate limit and router shared by every subset of the suite, and for REST models the worker
+        # pool, event loop and connections too (started on first use)
+        model_config = self.user_config.model
+        self.runtime = InferenceRuntime(
+            [model_config.url] if isinstance(model_config.url, str) else model_config.url,
+            routing=model_config.routing,
+            max_rps=model_config.max_rps,
+            burst=model_config.burst,
+            pool_size=model_config.pool_size,
+            # Every in-flight request of every concurrent subset gets a connection of its own
+            max_connections=model_config.max_in_flight * self.user_config.max_concurrent_subsets,
+        )
+        self.resume = resume
+        # (Evaluation, Evaluation.run arguments) of every subset, see _add_job
+        self.jobs = []
+        self.shared_datasets = SharedDatasets()
 
     def loop_langs(
         self,
@@ -146,6 +260,7 @@ class EvaluationSuite:
         input_columns,
         label_columns,
         subsets,
+        streaming=False,
     ):
         if input_columns is None or subsets is None or label_columns is None:
             input_columns = [None for i in range(len(source_languages))]
@@ -155,7 +270,7 @@ class EvaluationSuite:
         for slang, tlang, inp_col, label_col, subset in zip(
             source_languages, target_languages, input_columns, label_columns, subsets
         ):
-            self._run(slang, tlang, dataset_name, dataset_path, split, inp_col, label_col, subset)
+            self._add_job(slang, tlang, dataset_name, dataset_path, split, inp_col, label_col, subset, streaming)
 
     def run_datasets(self):
         for dataset in self.user_config.dataset:
@@ -170,9 +285,10 @@ class EvaluationSuite:
                     dataset.input_column,
                     dataset.label_column,
                     dataset.subset,
+                    dataset.streaming,
                 )
             else:
-                self._run(
+                self._add_job(
                     dataset.source_language,
                     dataset.target_language,
                     dataset.name,
@@ -181,21 +297,66 @@ class EvaluationSuite:
                     dataset.input_column,
                     dataset.label_column,
                     dataset.subset,
+                    dataset.streaming,
                 )
 
-    def _run(
-        self, source_language, target_language, dataset_name, dataset_path, split, input_column, label_column, subset
+    def _add_job(
+        self,
+        source_language,
+        target_language,
+        dataset_name,
+        dataset_path,
+        split,
+        input_column,
+        label_column,
+        subset,
+        streaming=False,
     ):
         logger.info(
             f"Source Language:{source_language} \
                         \tTarget Language: {target_language}"
         )
-        self.evaluator.initialise_dataset_params(
+        # One Evaluation per subset, so subsets can run side by side
+        evaluator = Evaluation(
+            self.user_config, resume=self.resume, runtime=self.runtime, shared_datasets=self.shared_datasets
+        )
+        evaluator.initialise_dataset_params(
             source_language, target_language, dataset_name, input_column, label_column, subset
         )
-        self.evaluator.run(dataset_path, dataset_name, split, source_language, target_language)
+        self.jobs.append((evaluator, (dataset_path, dataset_name, split, source_language, target_language, streaming)))
 
     def run(self):
+        try:
+            self.jobs = []
+            self.add_jobs()
+            self.run_jobs()
+        finally:
+            self.runtime.close()
+
+    def run_jobs(self):
+        """
+        Run up to max_concurrent_subsets subsets at once, the largest first so a big subset doesn't
+        start last and run alone. They share the runtime's workers, rate limit and connections.
+        """
+        model_config = self.user_config.model
+        if model_config.type.lower() == Enums.model_type.REST and model_config.engine != "async":
+            # Fork the workers now, before the job threads exist
+            self.runtime.pool()
+        budget = self.user_config.max_concurrent_subsets
+        if budget <= 1:
+            for evaluator, run_args in self.jobs:
+                evaluator.run(*run_args)
+            return
+
+        costs = {id(evaluator): evaluator.estimate_cost(*run_args[:3]) for evaluator, run_args in self.jobs}
+        jobs = sorted(self.jobs, key=lambda job: costs[id(job[0])], reverse=True)
+        with ThreadPoolExecutor(max_workers=budget) as executor:
+            futures = {executor.submit(evaluator.run, *run_args): evaluator.subset for evaluator, run_args in jobs}
+            for future in as_completed(futures):
+                future.result()
+                logger.info(f"Finished subset {futures[future]}")
+
+    def add_jobs(self):
         if isinstance(self.user_config.dataset, list):
             self.run_datasets()
 
@@ -209,10 +370,11 @@ class EvaluationSuite:
                 self.user_config.dataset.input_column,
                 self.user_config.dataset.label_column,
                 self.user_config.dataset.subset,
+                self.user_config.dataset.streaming,
             )
 
         else:
-            self._run(
+            self._add_job(
                 self.user_config.dataset.source_language,
                 self.user_config.dataset.target_language,
                 self.user_config.dataset.name,
@@ -221,12 +383,24 @@ class EvaluationSuite:
                 self.user_config.dataset.input_column,
                 self.user_config.dataset.label_column,
                 self.user_config.dataset.subset,
+                self.user_config.dataset.streaming,
             )
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--file", default="")
+    parser.add_argument(
+        "--cache",
+        choices=["read", "write", "off"],
+        default=None,
+        help="Response cache mode, overrides model.cache.mode from the config file",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip items that already succeeded in the checkpoints of a previous run",
+    )
     args = parser.parse_args()
-    suite = EvaluationSuite(args.file)
+    suite = EvaluationSuite(args.file, cache_mode=args.cache, resume=args.resume)
     suite.run()
@@ -1,4 +1,5 @@
 from .asr import DhruvaASREvaluator
 from .nmt import DhruvaMTEvaluator
 from .transliteration import DhruvaTransliterationEvaluator
-from .tts import DhruvaTTSEvaluator
\ No newline at end of file
+from .tts import DhruvaTTSEvaluator
+from .base import DhruvaEvaluatorMixin
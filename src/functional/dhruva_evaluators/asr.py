@@ -1,8 +1,9 @@
 import multiprocessing as mp
-from datasets import Dataset
+from datasets import Audio, Dataset
 from evaluate import Evaluator
 
 from dhruva_preprocessors import clean_and_normalize_transcripts
+from .base import DhruvaEvaluatorMixin
 
 
 TASK_DOCUMENTATION = r"""
@@ -23,7 +24,7 @@ TASK_DOCUMENTATION = r"""
 """
 
 
-class DhruvaASREvaluator(Evaluator):
+class DhruvaASREvaluator(DhruvaEvaluatorMixin, Evaluator):
     """
     Dhruva Automatic speech recognition evaluator.
     Methods in this class assume a data format compatible with Dhruva.
@@ -55,16 +56,31 @@ class DhruvaASREvaluator(Evaluator):
         """
 
         self.check_required_columns(data, {"input_column": input_column, "label_column": label_column})
+
+        # keep audio encoded while cleaning transcripts, otherwise map decodes and re-encodes every clip
+        audio_columns = {
+            column: feature
+            for column, feature in (data.features or {}).items()
+            if isinstance(feature, Audio) and feature.decode
+        }
+        for column, feature in audio_columns.items():
+            data = data.cast_column(column, Audio(sampling_rate=feature.sampling_rate, decode=False))
+
         # preprocess data based on language
-        data = data.map(
+        data = self.map_data(
+            data,
             lambda x: clean_and_normalize_transcripts(x, label_column, self.source_language),
             load_from_cache_file=False,
             disable_nullable=True,
             num_proc=mp.cpu_count(),
         )
 
+        for column, feature in audio_columns.items():
+            data = data.cast_column(column, feature)
+
         # concatenate_texts is for WER score to be calculated for the whole dataset
-        return {"references": data[label_column], "concatenate_texts": True}, data
+        references, data = self.split_references(data, label_column)
+        return self.track_metric_inputs({"references": references, "concatenate_texts": True}), data
 
     def predictions_processor(self, predictions, label_mapping):
-        return {"predictions": [pred["text"] for pred in predictions]}
+        return {"predictions": [pred["text"] if pred is not None else None for pred in predictions]}
@@ -0,0 +1,101 @@
+from datasets import IterableDataset, load_dataset
+
+from dhruva_logger import logger
+from .running_metric import RunningMetric
+
+
+class DhruvaEvaluatorMixin:
+    """
+    Shared behaviour of the Dhruva evaluators, mixed in ahead of the `evaluate` base class.
+    Items the model could not get an output for are predicted as `None`; they are left out
+    of the metric instead of being scored as empty outputs.
+    With `streaming` set, the split is read as an `IterableDataset` and handed to the model
+    as a generator, so nothing is materialised before the first request goes out.
+    Models with an `on_predictions` hook get a running estimate of the metric fed as batches
+    complete, for the evaluators that track their metric inputs.
+    """
+
+    streaming = False
+    # Seconds between two updates of the running metric estimate
+    running_metric_interval = 30.0
+    tracked_metric_inputs = None
+    prepared_metric = None
+
+    def load_data(self, data, subset: str = None, split: str = None):
+        if self.streaming and isinstance(data, str):
+            return load_dataset(data, name=subset, split=split or "test", streaming=True)
+        return super().load_data(data, subset=subset, split=split)
+
+    def check_required_columns(self, data, columns_names):
+        if isinstance(data, IterableDataset) and data.column_names is None:
+            # The columns of a streamed split are only known once its first item is read
+            return
+        return super().check_required_columns(data, columns_names)
+
+    @staticmethod
+    def map_data(data, function, **kwargs):
+        """`Dataset.map` for map-style data, a lazy `IterableDataset.map` (no caching / processes) for streams"""
+        if isinstance(data, IterableDataset):
+            return data.map(function, fn_kwargs=kwargs.get("fn_kwargs"))
+        return data.map(function, **kwargs)
+
+    @staticmethod
+    def split_references(data, label_column: str):
+        """
+        Returns:
+            `list`: references. For a streamed split it fills up as the model consumes the items.
+            pipeline inputs.
+        """
+        if not isinstance(data, IterableDataset):
+            return data[label_column], data
+
+        references = []
+
+        def stream_with_references():
+            for item in data:
+                references.append(item[label_column])
+                yield item
+
+        return references, stream_with_references()
+
+    def track_metric_inputs(self, metric_inputs: dict) -> dict:
+        """Keep the metric inputs of `prepare_data` for the running estimate"""
+        self.tracked_metric_inputs = metric_inputs
+        return metric_inputs
+
+    def prepare_metric(self, metric):
+        self.prepared_metric = super().prepare_metric(metric)
+        return self.prepared_metric
+
+    def call_pipeline(self, pipe, *args, **kwargs):
+        if not hasattr(pipe, "on_predictions") or self.tracked_metric_inputs is None:
+            return super().call_pipeline(pipe, *args, **kwargs)
+        try:
+            running_metric = RunningMetric(
+                self.prepared_metric,
+                self.tracked_metric_inputs,
+                self.predictions_processor,
+                interval=self.running_metric_interval,
+            )
+        except Exception as e:
+            logger.warning(f"No running estimate of {self.prepared_metric.name}: {e!r}")
+            return super().call_pipeline(pipe, *args, **kwargs)
+        pipe.on_predictions = running_metric.add_batch
+        try:
+            return super().call_pipeline(pipe, *args, **kwargs)
+        finally:
+            # The final score is only computed once the last estimate is done
+            pipe.on_predictions = None
+            running_metric.close()
+
+    def compute_metric(self, metric, metric_inputs, *args, **kwargs):
+        predictions = metric_inputs["predictions"]
+        kept = [i for i, prediction in enumerate(predictions) if prediction is not None]
+        if len(kept) < len(predictions):
+            logger.warning(f"Leaving {len(predictions) - len(kept)} failed item(s) out of the metric")
+            metric_inputs = {
+                **metric_inputs,
+                "predictions": [predictions[i] for i in kept],
+                "references": [metric_inputs["references"][i] for i in kept],
+            }
+        return super().compute_metric(metric, metric_inputs, *args, **kwargs)
@@ -5,6 +5,7 @@ from evaluate import Evaluator, EvaluationModule, TranslationEvaluator
 
 from constants import Enums, DATASET_INPUT_COLUMN_MAPPING
 from dhruva_preprocessors import normalize_language_codes
+from .base import DhruvaEvaluatorMixin
 
 
 TASK_DOCUMENTATION = r"""
@@ -25,7 +26,7 @@ TASK_DOCUMENTATION = r"""
 """
 
 
-class DhruvaMTEvaluator(TranslationEvaluator):
+class DhruvaMTEvaluator(DhruvaEvaluatorMixin, TranslationEvaluator):
     """
     Dhruva Translation evaluator.
     Methods in this class assume a data format compatible with Dhruva.
@@ -65,7 +66,8 @@ class DhruvaMTEvaluator(TranslationEvaluator):
         if self.dataset_name == Enums.datasets.FLORES:
             source_language = input_column.replace(DATASET_INPUT_COLUMN_MAPPING.get(self.dataset_name), "")
             target_language = label_column.replace(DATASET_INPUT_COLUMN_MAPPING.get(self.dataset_name), "")
-            data = data.map(
+            data = self.map_data(
+                data,
                 normalize_language_codes,
                 fn_kwargs={
                     "source_language": source_language,
@@ -74,7 +76,8 @@ class DhruvaMTEvaluator(TranslationEvaluator):
                 num_proc=mp.cpu_count(),
             )
 
-        return {"references": data[label_column]}, data
+        references, data = self.split_references(data, label_column)
+        return self.track_metric_inputs({"references": references}), data
 
     def predictions_processor(self, predictions, label_mapping):
-        return {"predictions": [pred["text"] for pred in predictions]}
+        return {"predictions": [pred["text"] if pred is not None else None for pred in predictions]}
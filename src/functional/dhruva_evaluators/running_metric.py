@@ -0,0 +1,70 @@
+import time
+import threading
+
+import evaluate
+
+from dhruva_logger import logger
+
+
+class RunningMetric:
+    """
+    Running estimate of the metric while predictions come in, logged at most every `interval`
+    seconds. It is computed with the same metric and inputs as the final score, on the items
+    predicted so far, so it converges to the final score, which is still computed once on all
+    predictions. `add_batch` is called from the threads delivering results (the pool's result
+    handler, the shared event loop), so the metric is computed on a thread of its own, with a
+    metric instance of its own so it never shares state with the final `compute`.
+    """
+
+    def __init__(self, metric, metric_inputs: dict, predictions_processor, interval: float = 30.0):
+        self.metric = evaluate.load(metric.name, metric.config_name, keep_in_memory=True)
+        self.references = metric_inputs["references"]
+        self.metric_kwargs = {key: value for key, value in metric_inputs.items() if key != "references"}
+        self.predictions_processor = predictions_processor
+        self.interval = interval
+        # Processed prediction of every item predicted so far, by dataset index
+        self.predictions = {}
+        self.estimate = None
+        self._last_update = time.monotonic()
+        self._lock = threading.Lock()
+        self._updater = None
+
+    def add_batch(self, indices, predictions):
+        processed = self.predictions_processor(list(predictions), None)["predictions"]
+        with self._lock:
+            for index, prediction in zip(indices, processed):
+                if prediction is not None:
+                    self.predictions[index] = prediction
+            if time.monotonic() - self._last_update < self.interval:
+                return
+            if self._updater is not None and self._updater.is_alive():
+                # The previous estimate is still being computed
+                return
+            self._last_update = time.monotonic()
+            self._updater = threading.Thread(target=self._update, args=(dict(self.predictions),), daemon=True)
+            self._updater.start()
+
+    def close(self):
+        """Wait for the estimate being computed, if any"""
+        with self._lock:
+            updater, self._updater = self._updater, None
+            # No new estimate once the model is done
+            self._last_update = float("inf")
+        if updater is not None:
+            updater.join()
+
+    def _update(self, predictions: dict):
+        # References of a streamed split only fill up as the model consumes it
+        indices = [index for index in sorted(predictions) if index < len(self.references)]
+        if not indices:
+            return
+        try:
+            self.estimate = self.metric.compute(
+                predictions=[predictions[index] for index in indices],
+                references=[self.references[index] for index in indices],
+                **self.metric_kwargs,
+            )
+        except Exception as e:
+            logger.warning(f"Could not update the running {self.metric.name}: {e!r}")
+            return
+        logger.info(f"Running {self.metric.name} on {len(indices)} item(s): {self.estimate}")
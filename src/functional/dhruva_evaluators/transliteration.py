@@ -4,6 +4,8 @@ import multiprocessing as mp
 from datasets import Dataset
 from evaluate import Evaluator
 
+from .base import DhruvaEvaluatorMixin
+
 
 TASK_DOCUMENTATION = r"""
     Examples:
@@ -24,7 +26,7 @@ TASK_DOCUMENTATION = r"""
 
 
 # Figure out how to pass config for datasets, preprocessors, postprocessors and metrics via evaluator
-class DhruvaTransliterationEvaluator(Evaluator):
+class DhruvaTransliterationEvaluator(DhruvaEvaluatorMixin, Evaluator):
     """
     Dhruva Automatic speech recognition evaluator.
     Methods in this class assume a data format compatible with Dhruva.
@@ -57,7 +59,8 @@ class DhruvaTransliterationEvaluator(Evaluator):
             `list`:  pipeline inputs.
         """
         self.check_required_columns(data, {"input_column": input_column, "label_column": label_column})
-        return {"references": data[label_column]}, data
+        references, data = self.split_references(data, label_column)
+        return self.track_metric_inputs({"references": references}), data
 
     def predictions_processor(self, predictions, label_mapping):
-        return {"predictions": [pred["text"] for pred in predictions]}
+        return {"predictions": [pred["text"] if pred is not None else None for pred in predictions]}
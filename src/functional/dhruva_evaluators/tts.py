@@ -5,6 +5,9 @@ import multiprocessing as mp
 from datasets import Dataset
 from evaluate import Evaluator, EvaluationModule
 
+from .base import DhruvaEvaluatorMixin
+
+
 TASK_DOCUMENTATION = r"""
     Examples:
     ```python
@@ -24,7 +27,7 @@ TASK_DOCUMENTATION = r"""
 
 
 # Figure out how to pass config for datasets, preprocessors, postprocessors and metrics via evaluator
-class DhruvaTTSEvaluator(Evaluator):
+class DhruvaTTSEvaluator(DhruvaEvaluatorMixin, Evaluator):
     """
     Dhruva Text to speech evaluator.
     Methods in this class assume a data format compatible with Dhruva.
@@ -57,7 +60,8 @@ class DhruvaTTSEvaluator(Evaluator):
         """
 
         self.check_required_columns(data, {"input_column": input_column, "label_column": label_column})
-        return {"references": data[label_column]}, data
+        references, data = self.split_references(data, label_column)
+        return {"references": references}, data
 
     def predictions_processor(self, predictions, label_mapping):
-        return {"predictions": [pred["path"] for pred in predictions]}
+        return {"predictions": [pred["path"] if pred is not None else None for pred in predictions]}
@@ -1,2 +1,4 @@
 from .dhruva_rest_api_wrapper import DhruvaRESTModel
-from .dhruva_socket_api_wrapper import DhruvaSocketModel
\ No newline at end of file
+from .dhruva_socket_api_wrapper import DhruvaSocketModel
+from .stats import InferenceStats
+from .runtime import InferenceRuntime
@@ -0,0 +1,102 @@
+import io
+import wave
+import base64
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from .pcm import to_pcm16, wav_slices
+
+SAMPLING_RATE = 16000
+
+
+def _is_wav(audio_bytes: bytes, sampling_rate: int = SAMPLING_RATE) -> bool:
+    """Check the RIFF header only, without decoding any samples"""
+    try:
+        with wave.open(io.BytesIO(audio_bytes)) as f:
+            return f.getframerate() == sampling_rate and f.getnchannels() == 1 and f.getsampwidth() == 2
+    except (wave.Error, EOFError):
+        return False
+
+
+def _to_mono_16k(array, sampling_rate: int):
+    array = np.asarray(array, dtype=np.float32)
+    if array.ndim > 1:
+        array = librosa.to_mono(array.T)
+    if sampling_rate != SAMPLING_RATE:
+        array = librosa.resample(array, orig_sr=sampling_rate, target_sr=SAMPLING_RATE)
+    return array
+
+
+def _array_to_wav(array, sampling_rate: int) -> bytes:
+    array = _to_mono_16k(array, sampling_rate)
+
+    buffer = io.BytesIO()
+    sf.write(buffer, array, SAMPLING_RATE, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def _to_wav(audio_bytes: bytes) -> bytes:
+    if _is_wav(audio_bytes):
+        return audio_bytes
+    array, sampling_rate = sf.read(io.BytesIO(audio_bytes), dtype="float32")
+    return _array_to_wav(array, sampling_rate)
+
+
+def encode_audio_to_wav(raw_input) -> bytes:
+    """
+    Get 16 kHz mono WAV bytes for an audio input without touching the disk when avoidable.
+    Args:
+        raw_input (`str` or `dict`): a file path, or a `datasets.Audio` struct with
+            `bytes`, `path` and / or `array` + `sampling_rate`.
+    Returns:
+        `bytes`: the WAV file contents.
+    """
+    if isinstance(raw_input, str):
+        raw_input = {"path": raw_input}
+
+    # Arrow-backed bytes (undecoded Audio column)
+    if raw_input.get("bytes") is not None:
+        return _to_wav(raw_input["bytes"])
+
+    # Decoded array, written straight into an in-memory buffer
+    if raw_input.get("array") is not None:
+        return _array_to_wav(raw_input["array"], raw_input["sampling_rate"])
+
+    with open(raw_input["path"], "rb") as f:
+        return _to_wav(f.read())
+
+
+def audio_duration(raw_input) -> float:
+    """
+    Duration in seconds of an audio input, read from the file header when it is still encoded.
+    Returns 0 for inputs whose header can't be read, they are encoded (and fail) later anyway.
+    """
+    if isinstance(raw_input, str):
+        raw_input = {"path": raw_input}
+    if raw_input.get("array") is not None:
+        return len(raw_input["array"]) / raw_input["sampling_rate"]
+    try:
+        if raw_input.get("bytes") is not None:
+            return sf.info(io.BytesIO(raw_input["bytes"])).duration
+        return sf.info(raw_input["path"]).duration
+    except (RuntimeError, OSError, TypeError):
+        return 0.0
+
+
+def pcm_wav_slices(array, sampling_rate: int, chunk_ms: int = 2000):
+    """
+    Split an utterance into 16 kHz mono WAV files of `chunk_ms` each. The samples are resampled
+    and converted to PCM once, then sliced as memoryviews, see `pcm.wav_slices`.
+    Yields:
+        `bytes`: WAV file of the next slice.
+        `float`: duration of the slice in seconds.
+    """
+    if np.ndim(array) > 1 or sampling_rate != SAMPLING_RATE:
+        array = _to_mono_16k(array, sampling_rate)
+    return wav_slices(to_pcm16(array), SAMPLING_RATE, chunk_ms)
+
+
+def encode_audio_to_base64(raw_input) -> str:
+    return base64.b64encode(encode_audio_to_wav(raw_input)).decode("utf-8")
@@ -0,0 +1,100 @@
+class BatchSizeController:
+    """
+    Picks the batch size for the next request of a (task, language) stream.
+    Starts at `initial_size` and doubles it every `window` batches while the per-item latency
+    and error rate stay within the SLO, otherwise halves it. Timeouts, 5xx and 413 count as
+    errors; when `overload_limit` of them hit the same size within one window, that size is
+    taken as too big and growth stops below it. The ceiling is lifted again after
+    `ceiling_windows` clean windows, so a flaky replica doesn't pin the size for the whole run.
+    """
+
+    def __init__(
+        self,
+        initial_size: int = 2,
+        min_size: int = 1,
+        max_size: int = 64,
+        latency_slo_ms: float = 500.0,
+        max_error_rate: float = 0.05,
+        window: int = 4,
+        overload_limit: int = 2,
+        ceiling_windows: int = 8,
+        adaptive: bool = True,
+    ):
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.size = min(max(initial_size, self.min_size), self.max_size)
+        self.latency_slo_ms = latency_slo_ms
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.overload_limit = overload_limit
+        self.ceiling_windows = ceiling_windows
+        self.adaptive = adaptive
+
+        # Smallest size that kept failing; growth stops below it
+        self.ceiling = self.max_size + 1
+        # Windows in a row without errors since the ceiling was last lowered
+        self._clean_windows = 0
+        self._requests = 0
+        self._latencies = []
+        self._errors = 0
+        self._overloads = 0
+
+    def next_size(self) -> int:
+        return self.size
+
+    def _reset_window(self):
+        self._requests = 0
+        self._latencies = []
+        self._errors = 0
+        self._overloads = 0
+
+    def _back_off(self, lower_ceiling: bool):
+        if lower_ceiling:
+            self.ceiling = min(self.ceiling, self.size)
+            self._clean_windows = 0
+        self.size = max(self.min_size, self.size // 2)
+        self._reset_window()
+
+    def record(self, batch_size: int, latency: float, success: bool = True, overloaded: bool = False):
+        """
+        Args:
+            batch_size (`int`): number of items sent in the request.
+            latency (`float`): wall-clock seconds the request took.
+            success (`bool`): whether the response could be parsed.
+            overloaded (`bool`): the request timed out or the service answered with a 5xx or 413.
+        """
+        if not self.adaptive or batch_size != self.size:
+            # Ignore requests that were sized before the last change (or a short tail batch)
+            return
+
+        self._requests += 1
+        self._errors += 0 if success else 1
+        if overloaded:
+            # A timeout's latency says nothing about the per-item cost, only count the error
+            self._overloads += 1
+            if self._overloads >= self.overload_limit:
+                self._back_off(lower_ceiling=True)
+                return
+        else:
+            self._latencies.append(latency)
+        if self._requests < self.window:
+            return
+
+        per_item_latency_ms = 1000 * sum(self._latencies) / max(len(self._latencies), 1) / self.size
+        error_rate = self._errors / self._requests
+        if per_item_latency_ms > self.latency_slo_ms:
+            self._back_off(lower_ceiling=True)
+            return
+        if error_rate > self.max_error_rate:
+            # Errors unrelated to the batch size (e.g. a flaky replica) shouldn't cap it for good
+            self._back_off(lower_ceiling=False)
+            return
+
+        if self._errors == 0 and self.ceiling <= self.max_size:
+            self._clean_windows += 1
+            if self._clean_windows >= self.ceiling_windows:
+                self.ceiling = self.max_size + 1
+                self._clean_windows = 0
+        if self.size * 2 < self.ceiling:
+            self.size = min(self.size * 2, self.max_size)
+        self._reset_window()
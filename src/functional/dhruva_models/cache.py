@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Optional
+
+
+class ResponseCache:
+    """
+    Local SQLite store of parsed service outputs, keyed on the endpoint, the task config and
+    the hash of the normalised input.
+    Modes:
+        `read`:  serve hits from the cache, fetch misses and store them.
+        `write`: always call the service and overwrite the stored entries.
+        `off`:   neither read nor write.
+    """
+
+    MODES = ("read", "write", "off")
+    # Eviction is checked every EVICT_EVERY writes
+    EVICT_EVERY = 256
+
+    def __init__(
+        self,
+        path: str = ".cache/dhruva_responses.sqlite",
+        mode: str = "off",
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"Cache mode must be one of {self.MODES}, got {mode}")
+        self.path = path
+        self.mode = mode
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def __getstate__(self):
+        # sqlite connections can't cross process boundaries, every worker opens its own
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, created_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+            self._pid = os.getpid()
+            self._evict()
+        return self._conn
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @staticmethod
+    def _normalise(part):
+        """Drop unset fields and decode base64 bytes, so validated and fast-path payloads hash alike"""
+        if isinstance(part, dict):
+            return {key: ResponseCache._normalise(value) for key, value in part.items() if value is not None}
+        if isinstance(part, list):
+            return [ResponseCache._normalise(value) for value in part]
+        if isinstance(part, bytes):
+            return part.decode("ascii")
+        return part
+
+    @staticmethod
+    def make_key(endpoint: str, task_config, item) -> str:
+        digest = hashlib.sha256()
+        for part in (endpoint, task_config, item):
+            part = ResponseCache._normalise(part)
+            digest.update(json.dumps(part, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        if self.mode != "read":
+            return None
+        row = self.conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds:
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value):
+        if not self.enabled:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self._evict()
+
+    def _evict(self):
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
@@ -0,0 +1,110 @@
+import os
+import glob
+import json
+import time
+from typing import List
+
+import pyarrow as pa
+
+CHECKPOINT_SCHEMA = pa.schema(
+    [
+        ("index", pa.int64()),
+        ("prediction", pa.string()),
+        ("latency", pa.float64()),
+        ("status", pa.string()),
+        ("error", pa.string()),
+    ]
+)
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+
+class ShardWriter:
+    """
+    Streams (index, prediction, latency, status, error) rows of one worker to an Arrow IPC stream file.
+    Every request is written as its own record batch straight to the file descriptor, so a
+    crashed run keeps everything up to the last completed request.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sink = None
+        self.writer = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.sink = pa.OSFile(self.path, "wb")
+        self.writer = pa.ipc.new_stream(self.sink, CHECKPOINT_SCHEMA)
+        return self
+
+    def __exit__(self, *args):
+        self.writer.close()
+        self.sink.close()
+
+    def write(self, indices: List[int], predictions: List[dict], latency: float, status: str, error: str = None):
+        batch = pa.record_batch(
+            [
+                pa.array(indices, pa.int64()),
+                pa.array([json.dumps(p, ensure_ascii=False) for p in predictions], pa.string()),
+                pa.array([latency] * len(indices), pa.float64()),
+                pa.array([status] * len(indices), pa.string()),
+                pa.array([error] * len(indices), pa.string()),
+            ],
+            schema=CHECKPOINT_SCHEMA,
+        )
+        self.writer.write_batch(batch)
+
+
+def new_shard_path(checkpoint_dir: str, shard_no: int) -> str:
+    """Every (re)started run writes new files next to the ones it resumes from"""
+    return os.path.join(checkpoint_dir, f"shard-{int(time.time() * 1000)}-{os.getpid()}-{shard_no:04d}.arrow")
+
+
+def retry_shard_path(shard_path: str) -> str:
+    """File for the second pass over the failed items of a shard"""
+    return shard_path[: -len(".arrow")] + "-retry.arrow"
+
+
+def clear_checkpoints(checkpoint_dir: str):
+    for path in glob.glob(os.path.join(checkpoint_dir, "shard-*.arrow")):
+        os.remove(path)
+
+
+def _read_batches(path: str):
+    """Yield the complete record batches of a stream file, stopping at a truncated tail"""
+    try:
+        with pa.ipc.open_stream(pa.memory_map(path)) as reader:
+            while True:
+                try:
+                    yield reader.read_next_batch()
+                except StopIteration:
+                    return
+    except (pa.ArrowInvalid, OSError):
+        return
+
+
+def _write_order(path: str):
+    """Shard files in the order they were written: by start time, each retry file after its shard"""
+    stem = path[: -len(".arrow")]
+    is_retry = stem.endswith("-retry")
+    return stem[: -len("-retry")] if is_retry else stem, is_retry
+
+
+def load_rows(checkpoint_dir: str) -> dict:
+    """
+    Collate the rows of every shard file in a checkpoint directory.
+    Returns:
+        `dict`: index -> row, preferring successful rows and otherwise the most recent one.
+    """
+    rows = {}
+    for path in sorted(glob.glob(os.path.join(checkpoint_dir, "shard-*.arrow")), key=_write_order):
+        for batch in _read_batches(path):
+            columns = batch.to_pydict()
+            for values in zip(*columns.values()):
+                row = dict(zip(columns.keys(), values))
+                previous = rows.get(row["index"])
+                if previous is None or previous["status"] != STATUS_OK:
+                    row["prediction"] = json.loads(row["prediction"])
+                    rows[row["index"]] = row
+    return rows
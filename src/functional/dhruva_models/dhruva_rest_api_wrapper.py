@@ -1,13 +1,43 @@
+import os
 import json
+import time
+import uuid
 import base64
+import asyncio
+import threading
+import functools
 import logging
+import shutil
 import requests
-import itertools
-from typing import List
-import multiprocessing as mp
+import tempfile
+from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
 
+import aiohttp
 import datasets
+import pyarrow as pa
 from tqdm import tqdm
+from requests.adapters import HTTPAdapter
+
+from .stats import InferenceStats
+from .batching import BatchSizeController
+from .audio import encode_audio_to_wav, encode_audio_to_base64, audio_duration
+from .cache import ResponseCache
+from .retry import RetryPolicy, ServiceError
+from .routing import EndpointRouter
+from .runtime import InferenceRuntime, RequestTrace, run_chunk, worker_rate_limiter, worker_router
+from .hedging import HedgePolicy
+from .payload_template import PayloadTemplate, loads
+from .checkpoint import (
+    ShardWriter,
+    STATUS_OK,
+    STATUS_ERROR,
+    new_shard_path,
+    retry_shard_path,
+    clear_checkpoints,
+    load_rows,
+)
+from dhruva_logger import logger
 from constants import (
     Enums,
     ULCA_LANGUAGE_CODE_TO_AKSHARANTAR_MAPPING,
@@ -43,9 +73,6 @@ from schema.services.response.ulca_transliteration_inference_response import (
     ULCATransliterationInferenceResponse,
 )
 
-BATCH_LEN = 2
-
-
 ULCATaskRequestSchemaMapping = {
     Enums.tasks.ASR: ULCAAsrInferenceRequest,
     Enums.tasks.TTS: ULCATtsInferenceRequest,
@@ -60,12 +87,140 @@ ULCATaskResponseSchemaMapping = {
     Enums.tasks.NMT: ULCATranslationInferenceResponse,
 }
 
-feature = datasets.Audio()
-
-
-def _encode_audio(raw_input):
-    data = feature.encode_example(raw_input)
-    return base64.b64encode(open(data["path"], "rb").read()).decode("utf-8")
+# One keep-alive session per worker process, keyed by pool size
+_SESSIONS = {}
+# Threads running hedged requests, keyed by pid so a forked worker doesn't inherit dead threads
+_HEDGE_EXECUTORS = {}
+# Datasets reopened from their Arrow cache files in a worker, keyed by file names and features
+_MAPPED_DATASETS = {}
+
+
+def _chunked(indexed_data, chunk_size: int):
+    """Cut a stream of (index, item) pairs into (indices, items) chunks"""
+    indices, items = [], []
+    for index, data in indexed_data:
+        indices.append(index)
+        items.append(data)
+        if len(items) == chunk_size:
+            yield indices, items
+            indices, items = [], []
+    if items:
+        yield indices, items
+
+
+def _file_schema(filename: str) -> pa.Schema:
+    with pa.memory_map(filename) as source:
+        return pa.ipc.open_stream(source).schema
+
+
+def _nullable(data_type: pa.DataType) -> pa.DataType:
+    """
+    `data_type` with every nested field nullable and without field metadata, the way
+    `Features.type` builds it. `map(disable_nullable=True)` writes non-nullable fields.
+    """
+    if pa.types.is_struct(data_type):
+        fields = [data_type.field(i) for i in range(data_type.num_fields)]
+        return pa.struct([pa.field(field.name, _nullable(field.type)) for field in fields])
+    if pa.types.is_fixed_size_list(data_type):
+        return pa.list_(_nullable(data_type.value_type), data_type.list_size)
+    if pa.types.is_large_list(data_type):
+        return pa.large_list(_nullable(data_type.value_type))
+    if pa.types.is_list(data_type):
+        return pa.list_(_nullable(data_type.value_type))
+    return data_type
+
+
+def _mapped_source(dataset: datasets.Dataset):
+    """
+    What a worker needs to reopen the dataset memory-mapped on its side, instead of receiving
+    its rows through pickle. None for datasets that live in memory, read through an indices
+    mapping (select / shuffle) or whose columns no longer match their files (remove_columns /
+    rename_column views), those are still sent as pickled chunks.
+    """
+    if not dataset.cache_files or dataset._indices is not None:
+        return None
+    filenames = tuple(cache_file["filename"] for cache_file in dataset.cache_files)
+    features_type = _nullable(dataset.features.type)
+    if any(_nullable(pa.struct(list(_file_schema(filename)))) != features_type for filename in filenames):
+        return None
+    return filenames, dataset.features
+
+
+def _chunk_rows(dataset: datasets.Dataset, indices: List[int]) -> datasets.Dataset:
+    """
+    Rows of a chunk sent to a worker through pickle. A plain `select` still references the whole
+    in-memory table and would pickle all of it, the flattened copy only holds the chunk's rows.
+    """
+    return dataset.select(indices).flatten_indices(keep_in_memory=True)
+
+
+def _open_mapped(filenames: tuple, features: datasets.Features) -> datasets.Dataset:
+    # The same files can be opened with different features, e.g. audio decoded or not
+    key = (filenames, repr(features))
+    dataset = _MAPPED_DATASETS.get(key)
+    if dataset is None:
+        info = datasets.DatasetInfo(features=features)
+        parts = [datasets.Dataset.from_file(filename, info=info) for filename in filenames]
+        dataset = parts[0] if len(parts) == 1 else datasets.concatenate_datasets(parts)
+        _MAPPED_DATASETS[key] = dataset
+    return dataset
+
+
+def _get_session(pool_size: int) -> requests.Session:
+    session = _SESSIONS.get(pool_size)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _SESSIONS[pool_size] = session
+    return session
+
+
+def _get_hedge_executor(pool_size: int) -> ThreadPoolExecutor:
+    executor = _HEDGE_EXECUTORS.get(os.getpid())
+    if executor is None:
+        # Room for a primary and a hedge, plus losing requests that are still running
+        executor = ThreadPoolExecutor(max_workers=pool_size)
+        _HEDGE_EXECUTORS[os.getpid()] = executor
+    return executor
+
+
+def _pool_counters(session: requests.Session):
+    """Total (connections opened, requests sent) over all urllib3 pools of the session"""
+    opened, sent = 0, 0
+    # The same adapter is mounted for http:// and https://, count each one once
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            sent += pool.num_requests
+    return opened, sent
+
+
+def _payload_items_key(payload: dict):
+    """Name of the list holding one entry per input item, None for single-input payloads"""
+    for key in ("audio", "input"):
+        if isinstance(payload.get(key), list):
+            return key
+    return None
+
+
+def _select_payload_items(payload: dict, indices: List):
+    items_key = _payload_items_key(payload)
+    if items_key is None or len(indices) == len(payload[items_key]):
+        return payload
+    return {**payload, items_key: [payload[items_key][i] for i in indices]}
+
+
+def _audio_input(data: dict, input_column: str):
+    audio = data["audio"]
+    if input_column in ("path", "bytes", "array") or input_column not in audio:
+        # Hand over the whole Audio struct so the encoder can use the bytes already in Arrow
+        return audio
+    return audio[input_column]
 
 
 def generate_asr_payload(batch_data: list, input_column: str, source_language: str, target_language: str = None):
@@ -82,7 +237,9 @@ def generate_asr_payload(batch_data: list, input_column: str, source_language: s
     payload["config"]["language"]["sourceLanguage"] = source_language
     if payload["config"]["language"]["sourceLanguage"] == "pa-IN":
         payload["config"]["language"]["sourceLanguage"] = "pa"
-    payload["audio"] = [{"audioContent": _encode_audio(data["audio"][input_column])} for data in batch_data]
+    payload["audio"] = [
+        {"audioContent": encode_audio_to_base64(_audio_input(data, input_column))} for data in batch_data
+    ]
     payload = ULCAAsrInferenceRequest(**payload)
     return payload.dict()
 
@@ -92,7 +249,7 @@ def parse_asr_response(response: dict):
         payload = ULCAAsrInferenceResponse(**response)
     except:
         print(response)
-        return [{"text": ""} for p in range(BATCH_LEN)]
+        raise
     return [{"text": p.source} for p in payload.output]
 
 
@@ -119,7 +276,7 @@ def parse_nmt_response(response: dict):
         payload = ULCATranslationInferenceResponse(**response)
     except:
         print(response)
-        return [{"text": ""} for p in range(BATCH_LEN)]
+        raise
     return [{"text": p.target} for p in payload.output]
 
 
@@ -141,7 +298,7 @@ def parse_tts_response(response):
         payload = ULCATtsInferenceResponse(**response)
     except:
         print(response)
-        return [{"audio": ""} for p in range(BATCH_LEN)]
+        raise
     return [{"audio": p.audioContent} for p in payload.audio]
 
 
@@ -172,83 +329,694 @@ def parse_transliteration_response(response):
         return [{"text": p.target[0]} for p in payload.output]
     except:
         print(response)
-        return [{"text": [""]} for p in range(BATCH_LEN)]
+        raise
+
+
+# Fast path: (items list, value field) of the request body of each task
+FAST_PAYLOAD_FIELDS = {
+    Enums.tasks.ASR: ("audio", "audioContent"),
+    Enums.tasks.NMT: ("input", "source"),
+    Enums.tasks.Transliteration: ("input", "source"),
+}
+
+FAST_ITEM_VALUES = {
+    Enums.tasks.ASR: lambda data, input_column: base64.b64encode(encode_audio_to_wav(_audio_input(data, input_column))),
+    Enums.tasks.NMT: lambda data, input_column: data[input_column],
+    Enums.tasks.Transliteration: lambda data, input_column: str(data[input_column]),
+}
+
+# Cost of an item for the server (audio seconds, words, characters), used to batch similar items together
+ITEM_LENGTHS = {
+    Enums.tasks.ASR: lambda data, input_column: audio_duration(_audio_input(data, input_column)),
+    Enums.tasks.NMT: lambda data, input_column: len(data[input_column].split()),
+    Enums.tasks.Transliteration: lambda data, input_column: len(str(data[input_column])),
+}
+
+FAST_RESPONSE_PARSERS = {
+    Enums.tasks.ASR: lambda response: [{"text": p["source"]} for p in response["output"]],
+    Enums.tasks.NMT: lambda response: [{"text": p["target"]} for p in response["output"]],
+    Enums.tasks.Transliteration: lambda response: [{"text": p["target"][0]} for p in response["output"]],
+}
 
 
 class DhruvaRESTModel:
     def __init__(
         self,
         task: str,
-        url: str,
+        url: Union[str, List[str]],
         input_column: str,
         api_key: str,
         source_language: str,
         target_language: str,
+        engine: str = "process",
+        max_in_flight: int = 8,
+        pool_size: int = 10,
+        batching: dict = None,
+        cache: dict = None,
+        retry: dict = None,
+        max_rps: float = None,
+        burst: int = 1,
+        full_validation: bool = False,
+        checkpoint_dir: str = None,
+        resume: bool = False,
+        routing: str = "round_robin",
+        hedging: dict = None,
+        chunk_size: int = 64,
+        runtime: InferenceRuntime = None,
         **kwargs,
     ):
         self.task = task
-        self.url = url
+        # Several URLs are replicas of the same service, requests are spread over them by the router
+        self.urls = [url] if isinstance(url, str) else list(url)
+        # Worker pool, event loop, rate limiter and router, shared with the other models of a suite
+        # when one is given, otherwise owned by this model and closed after its run
+        self.owns_runtime = runtime is None
+        self.runtime = runtime or InferenceRuntime(
+            self.urls, routing, max_rps, burst, pool_size, max_connections=max_in_flight
+        )
+        self.rate_limiter = self.runtime.rate_limiter
+        self.router = self.runtime.router
+        # Identifies this model's copies in the pool workers
+        self.run_id = uuid.uuid4().hex
+        # Replicas return the same outputs, so they share cache entries
+        self.cache_namespace = " ".join(sorted(self.urls))
         self.service_id = None
         self.input_column = input_column
         self.headers = {"Authorization": api_key}
         self.source_language = source_language
         self.target_language = target_language
-
-    def _infer(self, batch_data: List):
-        try:
-            self.payload = globals()[f"generate_{self.task}_payload"](
+        # "process" shards the dataset across cpu_count() processes,
+        # "async" keeps up to max_in_flight requests open from a single event loop
+        self.engine = engine
+        self.max_in_flight = max_in_flight
+        self.pool_size = pool_size
+        self.stats = InferenceStats()
+
+        batching = dict(batching or {})
+        # Items are sorted by length within windows of bucket_window items before being batched,
+        # so the server doesn't pad short inputs up to a long one
+        self.bucket_by_length = batching.pop("bucket_by_length", True) and self.task in ITEM_LENGTHS
+        self.bucket_window = batching.pop("bucket_window", 256)
+        # Items per unit of work handed to an idle process worker
+        self.chunk_size = chunk_size
+        max_size = batching.get("max_size", 64)
+        if self.engine != "async" and max_size > chunk_size:
+            # A process worker never holds more than a chunk, larger batches could not be sent
+            logger.warning(f"batching.max_size {max_size} is above chunk_size {chunk_size}, capping it at {chunk_size}")
+            batching["max_size"] = chunk_size
+        if self.task == Enums.tasks.TTS:
+            # TTS payloads carry a single input, see generate_tts_payload
+            batching.update(initial_size=1, max_size=1)
+        self.batch_controller = BatchSizeController(**batching)
+        self.cache = ResponseCache(**(cache or {}))
+        self.retry_policy = RetryPolicy(**(retry or {}))
+        self.hedge_policy = HedgePolicy(**(hedging or {}))
+        # Validate every request and response through the pydantic schemas instead of only the first request
+        self.full_validation = full_validation
+        self.payload_template = None
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        # Streams can't be read again, so their failed items are retried by the worker at the end
+        # of its chunk. Failed items of a map-style dataset are retried at the end of the run.
+        self.retry_per_shard = True
+        # Called with (indices, outputs) as batches complete, e.g. by an evaluator's running metric.
+        # Pool workers can't call it, they send their outputs back with the chunk stats instead.
+        self.on_predictions = None
+        self.collect_predictions = False
+        self.emitted = None
+
+    def __getstate__(self):
+        # The rate limiter and router reach the workers through the pool initializer, see runtime._init_worker
+        state = self.__dict__.copy()
+        state["runtime"] = None
+        state["rate_limiter"] = None
+        state["router"] = None
+        state["stats"] = InferenceStats()
+        state["on_predictions"] = None
+        # Last payload sent, possibly megabytes of audio
+        state.pop("payload", None)
+        return state
+
+    def _get_rate_limiter(self):
+        return self.rate_limiter or worker_rate_limiter()
+
+    def _get_router(self) -> EndpointRouter:
+        return self.router or worker_router()
+
+    def _generate_payload(self, batch_data: List):
+        fields = FAST_PAYLOAD_FIELDS.get(self.task)
+        if self.full_validation or fields is None:
+            payload = globals()[f"generate_{self.task}_payload"](
                 batch_data, self.input_column, self.source_language, self.target_language
             )
-
-            if self.payload is None:
+            if payload is None:
                 raise ValueError("Empty payload")
-            results = requests.post(
-                self.url,
-                data=json.dumps(self.payload),
+            return payload
+
+        if self.payload_template is None:
+            # Validate the task config once, through the pydantic schema, on the first item
+            validated_payload = globals()[f"generate_{self.task}_payload"](
+                batch_data[:1], self.input_column, self.source_language, self.target_language
+            )
+            self.payload_template = PayloadTemplate(validated_payload, *fields)
+        item_value = FAST_ITEM_VALUES[self.task]
+        return self.payload_template.payload([item_value(data, self.input_column) for data in batch_data])
+
+    def _serialize_payload(self, payload: dict) -> bytes:
+        if self.payload_template is not None:
+            return self.payload_template.render(payload)
+        return json.dumps(payload).encode("utf-8")
+
+    def _parse_response(self, body: bytes):
+        if self.payload_template is not None:
+            return FAST_RESPONSE_PARSERS[self.task](loads(body))
+        return globals()[f"parse_{self.task}_response"](json.loads(body))
+
+    def _read_cache(self, payload: dict):
+        """
+        Split a payload into per-item cache keys and look them up.
+        Returns:
+            `list`: cache key of every item.
+            `list`: cached output of every item, `None` for misses.
+        """
+        items_key = _payload_items_key(payload)
+        num_items = 1 if items_key is None else len(payload[items_key])
+        if not self.cache.enabled:
+            # Nothing to look up, skip hashing (possibly multi-megabyte) payloads
+            return [None] * num_items, [None] * num_items
+        if items_key is None:
+            # Single-input payloads (TTS) are cached as a whole
+            keys = [ResponseCache.make_key(self.cache_namespace, {}, payload)]
+        else:
+            task_config = {key: value for key, value in payload.items() if key != items_key}
+            keys = [ResponseCache.make_key(self.cache_namespace, task_config, item) for item in payload[items_key]]
+
+        cached = [self.cache.get(key) for key in keys]
+        hits = sum(result is not None for result in cached)
+        self.stats.cache_hits += hits
+        self.stats.cache_misses += len(cached) - hits
+        return keys, cached
+
+    def _write_cache(self, keys: List, parsed_results: List):
+        for key, result in zip(keys, parsed_results):
+            self.cache.set(key, result)
+
+    def _post(self, payload: dict, num_items: int):
+        """Send a payload, hedged when it is slow. The caller has already taken a rate limiter token."""
+        rate_limiter = self._get_rate_limiter()
+        body = self._serialize_payload(payload)
+        delay = self.hedge_policy.delay()
+        if delay is None:
+            return self._send(body, num_items)
+
+        executor = _get_hedge_executor(self.pool_size)
+        primary = executor.submit(self._send, body, num_items)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        if not self.hedge_policy.spend():
+            return primary.result()
+
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        self.stats.hedges_sent += 1
+        hedge = executor.submit(self._send, body, num_items)
+        # The first successful response wins, the other request runs to completion in the background
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.stats.hedges_won += 1
+                    return future.result()
+        return primary.result()
+
+    def _send(self, body: bytes, num_items: int):
+        """One request to the endpoint picked by the router. Returns the parsed outputs."""
+        router = self._get_router()
+        url = router.acquire()
+        self.stats.mark_request()
+        start, success = time.time(), False
+        try:
+            response = _get_session(self.pool_size).post(
+                url,
+                data=body,
                 headers=self.headers,
-                timeout=90,
-            ).json()
-            parsed_results = globals()[f"parse_{self.task}_response"](results)
+                timeout=self.retry_policy.timeout,
+            )
+            if response.status_code >= 500 or response.status_code in (413, 429):
+                raise ServiceError(response.status_code)
+            parsed_results = self._parse_response(response.content)
+            if len(parsed_results) != num_items:
+                raise ValueError(f"Expected {num_items} outputs, got {len(parsed_results)}")
+            success = True
+            return parsed_results
+        finally:
+            latency = time.time() - start
+            router.release(url, latency, success)
+            self.stats.record_request(latency, len(body), num_items, success, endpoint=url)
+            if success:
+                self.hedge_policy.record(latency)
+
+    def _start_batch(self, batch_data: List):
+        """
+        Build the payload of a batch and look its items up in the cache.
+        Returns:
+            `dict`: payload of the items missing from the cache.
+            `list`: cache key of every item.
+            `list`: cached output of every item, `None` for misses.
+            `list`: positions of the missed items in the batch.
+        """
+        payload = self._generate_payload(batch_data)
+        keys, all_results = self._read_cache(payload)
+        missing = [i for i, result in enumerate(all_results) if result is None]
+        if missing:
+            payload = _select_payload_items(payload, missing)
+        return payload, keys, all_results, missing
+
+    def _record_failure(self, e: Exception, num_items: int, request_start: float):
+        overloaded = RetryPolicy.is_overloaded(e)
+        self.batch_controller.record(num_items, time.time() - request_start, success=False, overloaded=overloaded)
+
+    def _finish_batch(self, keys: List, all_results: List, missing: List[int], parsed_results: List, request_start):
+        """Record the successful request and merge its outputs into the cached ones"""
+        self.batch_controller.record(len(missing), time.time() - request_start)
+        self._write_cache([keys[i] for i in missing], parsed_results)
+        for i, result in zip(missing, parsed_results):
+            all_results[i] = result
+        return all_results
 
+    def _infer(self, batch_data: List, retry_timeouts: bool = False):
+        """
+        Returns:
+            `list`: one output per item, `None` for the uncached items of a failed batch.
+            `float`: wall-clock seconds spent on the batch, including retries.
+            `str`: checkpoint status of the outputs.
+            `str`: error of a failed batch.
+        """
+        start = time.time()
+        try:
+            payload, keys, all_results, missing = self._start_batch(batch_data)
         except Exception as e:
-            import traceback
-
-            print(traceback.print_exc(e))
-            return [{"text": ""} for p in range(BATCH_LEN)]
-
-        return parsed_results
-
-    def infer_batch(self, all_data):
-        all_results = []
-        batch_data = []
-
-        # .cache/huggingface/
-        # Later, write all outputs to some file
-        for data in tqdm(all_data):
+            logger.error(f"Could not build the payload: {e!r}")
+            return [None for _ in batch_data], time.time() - start, STATUS_ERROR, repr(e)
+        if not missing:
+            return all_results, time.time() - start, STATUS_OK, None
+
+        rate_limiter = self._get_rate_limiter()
+        attempt = 0
+        while True:
+            # Time spent waiting for a token is not service latency, keep it out of the batch controller
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            request_start = time.time()
+            try:
+                parsed_results = self._post(payload, len(missing))
+                break
+            except Exception as e:
+                self._record_failure(e, len(missing), request_start)
+                if not self.retry_policy.should_retry(e, attempt, retry_timeouts):
+                    logger.error(f"Batch of {len(missing)} failed after {attempt + 1} attempt(s): {e!r}")
+                    return all_results, time.time() - start, STATUS_ERROR, repr(e)
+                time.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+
+        all_results = self._finish_batch(keys, all_results, missing, parsed_results, request_start)
+        return all_results, time.time() - start, STATUS_OK, None
+
+    def _bucket_by_length(self, indexed_data):
+        """
+        Reorder (index, item) pairs by length within consecutive windows of `bucket_window` items.
+        Only a window is held at a time, so this works on streams too. Outputs are put back in
+        dataset order through their index.
+        """
+        item_length = ITEM_LENGTHS[self.task]
+        window = []
+        for pair in indexed_data:
+            window.append((item_length(pair[1], self.input_column), pair))
+            if len(window) == self.bucket_window:
+                window.sort(key=lambda entry: entry[0])
+                yield from (pair for _, pair in window)
+                window = []
+        window.sort(key=lambda entry: entry[0])
+        yield from (pair for _, pair in window)
+
+    def _iter_batches(self, indexed_data):
+        """
+        Group (index, item) pairs into batches, asking the batch controller for the size of each new batch.
+        Yields:
+            `list`: dataset indices of the batch.
+            `list`: items of the batch.
+        """
+        if self.bucket_by_length:
+            indexed_data = self._bucket_by_length(indexed_data)
+        indices, batch_data = [], []
+        for index, data in indexed_data:
+            indices.append(index)
             batch_data.append(data)
-            if len(batch_data) == BATCH_LEN:
-                results = self._infer(batch_data)
-                if results is not None:
-                    all_results.extend(results)
-                    batch_data = []
-                else:
-                    print(data["path"])
-
+            if len(batch_data) >= self.batch_controller.next_size():
+                yield indices, batch_data
+                indices, batch_data = [], []
         if batch_data:
-            results = self._infer(batch_data)
-            all_results.extend(results)
-        return all_results
+            yield indices, batch_data
+
+    def _run_shard(self, shard_path: str, indexed_data):
+        """
+        Sequential loop of one worker: batch (index, item) pairs, infer, and stream the rows to a
+        checkpoint file. Items of failed batches of a stream are retried one by one once the shard is done.
+        """
+        counters_before = _pool_counters(_get_session(self.pool_size))
+        failed = []
+        with ShardWriter(shard_path) as writer:
+            for batch_indices, batch_data in self._iter_batches(indexed_data):
+                failed.extend(self._write_batch(writer, batch_indices, batch_data, self._infer(batch_data)))
+
+        self._record_pool_usage(counters_before)
+        self.stats.final_batch_sizes[os.getpid()] = self.batch_controller.next_size()
+        if failed and self.retry_policy.final_pass and self.retry_per_shard:
+            self._retry_failed(failed, retry_shard_path(shard_path))
+
+    def infer_chunk(self, chunk):
+        """
+        Run one chunk of a dataset in a pool worker. The chunk carries either the dataset's
+        cache files, opened memory-mapped here, or its own rows.
+        Returns:
+            `InferenceStats`: stats of the chunk.
+            `list`: (indices, outputs) of its batches, when the parent collects predictions.
+        """
+        shard_path, indices, source = chunk
+        all_data = _open_mapped(*source).select(indices) if isinstance(source, tuple) else source
+        self.stats = InferenceStats()
+        self.emitted = [] if self.collect_predictions else None
+        self._run_shard(shard_path, zip(indices, all_data))
+        return self.stats, self.emitted or []
+
+    def _write_batch(self, writer: ShardWriter, indices: List[int], batch_data: List, outputs: tuple):
+        """
+        Checkpoint and emit the outputs of a batch. Cached items of a failed batch are kept as done.
+        Returns:
+            `list`: (index, item) pairs that failed.
+        """
+        results, latency, status, error = outputs
+        if status == STATUS_OK:
+            writer.write(indices, results, latency, status, error)
+            self._emit(indices, results)
+            return []
+        done = [i for i, result in enumerate(results) if result is not None]
+        failed = [i for i, result in enumerate(results) if result is None]
+        if done:
+            writer.write([indices[i] for i in done], [results[i] for i in done], latency, STATUS_OK)
+        writer.write([indices[i] for i in failed], [None for _ in failed], latency, status, error)
+        self._emit(indices, results)
+        return [(indices[i], batch_data[i]) for i in failed]
+
+    def _record_pool_usage(self, counters_before: tuple):
+        """Add the requests and connections of the process' session since `counters_before` to the stats"""
+        opened_before, sent_before = counters_before
+        opened_after, sent_after = _pool_counters(_get_session(self.pool_size))
+        self.stats.requests += sent_after - sent_before
+        self.stats.connections_opened += opened_after - opened_before
+        self.stats.connections_reused += (sent_after - sent_before) - (opened_after - opened_before)
+
+    def _emit(self, indices: List[int], results: List):
+        """Hand the outputs of a finished batch to `on_predictions`, or keep them for the parent process"""
+        if self.on_predictions is not None:
+            self.on_predictions(indices, results)
+        elif self.emitted is not None:
+            self.emitted.append((indices, results))
+
+    def _longest_first(self, all_audios: datasets.Dataset, pending: List[int]) -> List[int]:
+        """Order pending indices by decreasing item length, so the long items don't end up in the tail"""
+        if not self.bucket_by_length:
+            return pending
+        item_length = ITEM_LENGTHS[self.task]
+        lengths = [item_length(data, self.input_column) for data in all_audios.select(pending)]
+        return [index for _, index in sorted(zip(lengths, pending), key=lambda entry: -entry[0])]
+
+    def _run_chunks(self, chunks, checkpoint_dir: str, total: int = None):
+        """
+        Run (indices, source) chunks on the runtime's worker pool, an idle worker taking the next one.
+        At most two chunks per worker are queued at a time, so a stream is only read as fast as
+        the workers get through it.
+        """
+        pool = self.runtime.pool()
+        max_queued = 2 * self.runtime.num_processes
+        slots = threading.BoundedSemaphore(max_queued)
+        progress = tqdm(total=total)
+        errors = []
+
+        def on_done(result, num_items):
+            chunk_stats, emitted = result
+            self.stats.merge(chunk_stats)
+            for indices, results in emitted:
+                self._emit(indices, results)
+            progress.update(num_items)
+            slots.release()
+
+        def on_error(e):
+            errors.append(e)
+            slots.release()
+
+        for chunk_no, (indices, source) in enumerate(chunks):
+            slots.acquire()
+            if errors:
+                slots.release()
+                break
+            pool.apply_async(
+                run_chunk,
+                (self, (new_shard_path(checkpoint_dir, chunk_no), indices, source)),
+                callback=functools.partial(on_done, num_items=len(indices)),
+                error_callback=on_error,
+            )
+        # Wait for the queued chunks
+        for _ in range(max_queued):
+            slots.acquire()
+        progress.close()
+        if errors:
+            raise errors[0]
+
+    async def _post_async(self, session: aiohttp.ClientSession, payload: dict, num_items: int):
+        """Send a payload, hedged when it is slow. The caller has already taken a rate limiter token."""
+        rate_limiter = self._get_rate_limiter()
+        body = self._serialize_payload(payload)
+        delay = self.hedge_policy.delay()
+        if delay is None:
+            return await self._send_async(session, body, num_items)
+
+        primary = asyncio.ensure_future(self._send_async(session, body, num_items))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.hedge_policy.spend():
+            return await primary
+
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async()
+        self.stats.hedges_sent += 1
+        hedge = asyncio.ensure_future(self._send_async(session, body, num_items))
+        # The first successful response wins and the other request is cancelled
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.stats.hedges_won += 1
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _send_async(self, session: aiohttp.ClientSession, body: bytes, num_items: int):
+        router = self._get_router()
+        url = router.acquire()
+        self.stats.mark_request()
+        trace = RequestTrace(self.stats)
+        start, success, cancelled = time.time(), False, False
+        try:
+            async with session.post(
+                url,
+                data=body,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.retry_policy.timeout),
+                trace_request_ctx=trace,
+            ) as response:
+                self.stats.requests += 1
+                if response.status >= 500 or response.status in (413, 429):
+                    raise ServiceError(response.status)
+                response_body = await response.read()
+            parsed_results = self._parse_response(response_body)
+            if len(parsed_results) != num_items:
+                raise ValueError(f"Expected {num_items} outputs, got {len(parsed_results)}")
+            success = True
+            return parsed_results
+        except asyncio.CancelledError:
+            # Lost to a hedge: not a failure of the endpoint, and not a complete request either
+            cancelled = True
+            raise
+        finally:
+            # Time spent waiting for a free connection is not the endpoint's latency
+            latency = time.time() - (trace.dequeued_at or start)
+            # A cancelled request says nothing about the endpoint's latency, only its slot is given back
+            router.release(url, None if cancelled else latency, success or cancelled)
+            if not cancelled:
+                self.stats.record_request(latency, len(body), num_items, success, endpoint=url)
+            if success:
+                self.hedge_policy.record(latency)
+
+    async def _infer_async(self, session: aiohttp.ClientSession, batch_data: List):
+        start = time.time()
+        try:
+            payload, keys, all_results, missing = self._start_batch(batch_data)
+        except Exception as e:
+            logger.error(f"Could not build the payload: {e!r}")
+            return [None for _ in batch_data], time.time() - start, STATUS_ERROR, repr(e)
+        if not missing:
+            return all_results, time.time() - start, STATUS_OK, None
+
+        rate_limiter = self._get_rate_limiter()
+        attempt = 0
+        while True:
+            # Time spent waiting for a token is not service latency, keep it out of the batch controller
+            if rate_limiter is not None:
+                await rate_limiter.acquire_async()
+            request_start = time.time()
+            try:
+                parsed_results = await self._post_async(session, payload, len(missing))
+                break
+            except Exception as e:
+                self._record_failure(e, len(missing), request_start)
+                if not self.retry_policy.should_retry(e, attempt):
+                    logger.error(f"Batch of {len(missing)} failed after {attempt + 1} attempt(s): {e!r}")
+                    return all_results, time.time() - start, STATUS_ERROR, repr(e)
+                await asyncio.sleep(self.retry_policy.backoff(attempt))
+                attempt += 1
+
+        all_results = self._finish_batch(keys, all_results, missing, parsed_results, request_start)
+        return all_results, time.time() - start, STATUS_OK, None
+
+    async def _infer_all_async(self, shard_path: str, indexed_data, total: int = None):
+        # Batches are pulled from a shared iterator by max_in_flight workers, in a thread so
+        # that reading / encoding items doesn't block the event loop. Only the in-flight
+        # batches are held in memory. Rows are checkpointed with their dataset index and
+        # put back in order by the caller.
+        batches = self._iter_batches(indexed_data)
+        batches_lock = asyncio.Lock()
+        progress = tqdm(total=total)
+        failed = []
+
+        async def next_batch():
+            async with batches_lock:
+                return await asyncio.to_thread(next, batches, None)
+
+        async def worker(session, writer):
+            while (batch := await next_batch()) is not None:
+                batch_indices, batch_data = batch
+                outputs = await self._infer_async(session, batch_data)
+                failed.extend(self._write_batch(writer, batch_indices, batch_data, outputs))
+                progress.update(len(batch_data))
+
+        # The runtime's keep-alive session, shared by every run of a suite
+        session = self.runtime.http_session()
+        with ShardWriter(shard_path) as writer:
+            await asyncio.gather(*[worker(session, writer) for _ in range(self.max_in_flight)])
+        progress.close()
+        self.stats.final_batch_sizes[os.getpid()] = self.batch_controller.next_size()
+
+        if failed and self.retry_policy.final_pass and self.retry_per_shard:
+            # Blocking requests, kept off the event loop other runs may be sharing
+            await asyncio.to_thread(self._retry_failed, failed, retry_shard_path(shard_path))
+
+    def _retry_failed(self, indexed_data: List, shard_path: str):
+        """Second chance for the items of failed batches, one item per request, timeouts included"""
+        logger.warning(f"Retrying {len(indexed_data)} failed item(s)")
+        counters_before = _pool_counters(_get_session(self.pool_size))
+        with ShardWriter(shard_path) as writer:
+            for index, data in tqdm(indexed_data):
+                self._write_batch(writer, [index], [data], self._infer([data], retry_timeouts=True))
+
+        self._record_pool_usage(counters_before)
 
     def __call__(self, all_audios, **kwargs):
-        # If we do multiprocesing here, read from generator / list and split between processes
-        # Write to pyarrow files from each process
-        # collate responses from all files and stream / return
-
-        num_processes = mp.cpu_count()
-        with mp.Pool(processes=num_processes) as pool:
-            results = pool.map(
-                self.infer_batch,
-                [all_audios.shard(num_shards=num_processes, index=i, contiguous=True) for i in range(num_processes)],
-            )
-            all_results = list(itertools.chain(*results))
+        try:
+            return self._run(all_audios)
+        finally:
+            if self.owns_runtime:
+                self.runtime.close()
+
+    def _run(self, all_audios):
+        self.stats = InferenceStats()
+        if self.task == Enums.tasks.ASR and isinstance(all_audios, datasets.Dataset):
+            # Read the encoded audio straight from Arrow instead of decoding it only to re-encode it
+            audio_feature = all_audios.features.get("audio")
+            if isinstance(audio_feature, datasets.Audio) and audio_feature.decode:
+                all_audios = all_audios.cast_column(
+                    "audio", datasets.Audio(sampling_rate=audio_feature.sampling_rate, decode=False)
+                )
+
+        # Workers stream their rows to Arrow files in the checkpoint directory and the
+        # outputs are collated from those files, so a crashed run can be resumed.
+        checkpoint_dir = self.checkpoint_dir or tempfile.mkdtemp(prefix="dhruva-checkpoint-")
+        if not self.resume:
+            clear_checkpoints(checkpoint_dir)
+        completed = {index: row for index, row in load_rows(checkpoint_dir).items() if row["status"] == STATUS_OK}
+        if completed:
+            logger.info(f"Resuming from {checkpoint_dir}: skipping {len(completed)} completed item(s)")
+        self.collect_predictions = self.on_predictions is not None
+        for index, row in completed.items():
+            self._emit([index], [row["prediction"]])
+
+        self.retry_per_shard = not isinstance(all_audios, datasets.Dataset)
+        if not isinstance(all_audios, datasets.Dataset):
+            # Streamed split (IterableDataset / generator): the length is only known at the end
+            indexed_data = ((index, data) for index, data in enumerate(all_audios) if index not in completed)
+            if self.engine == "async":
+                self.runtime.run_async(self._infer_all_async(new_shard_path(checkpoint_dir, 0), indexed_data))
+            else:
+                self._run_chunks(_chunked(indexed_data, self.chunk_size), checkpoint_dir)
+            rows = load_rows(checkpoint_dir)
+            num_items = max(rows, default=-1) + 1
+
+        else:
+            pending = [index for index in range(len(all_audios)) if index not in completed]
+            pending = self._longest_first(all_audios, pending)
+            if pending and self.engine == "async":
+                self.runtime.run_async(
+                    self._infer_all_async(
+                        new_shard_path(checkpoint_dir, 0), zip(pending, all_audios.select(pending)), len(pending)
+                    )
+                )
+
+            elif pending:
+                # Small chunks on a shared queue: an idle worker takes the next chunk, so no worker
+                # is left with a long tail while the others sit idle
+                chunks = [pending[start : start + self.chunk_size] for start in range(0, len(pending), self.chunk_size)]
+                # Workers only get indices and the Arrow cache file names when the dataset is on disk
+                source = _mapped_source(all_audios)
+                if source is None and all_audios.cache_files:
+                    logger.warning(
+                        "The dataset is on disk but no longer matches its cache files, its rows are pickled to the workers"
+                    )
+                self._run_chunks(
+                    ((chunk, source or _chunk_rows(all_audios, chunk)) for chunk in chunks),
+                    checkpoint_dir,
+                    len(pending),
+                )
+            rows = load_rows(checkpoint_dir)
+            failed = [index for index in pending if rows[index]["status"] != STATUS_OK]
+            if failed and self.retry_policy.final_pass:
+                # One pass at the end of the run, so a short outage has time to clear
+                retry_path = retry_shard_path(new_shard_path(checkpoint_dir, 0))
+                self._retry_failed(list(zip(failed, all_audios.select(failed))), retry_path)
+                rows = load_rows(checkpoint_dir)
+            num_items = len(all_audios)
+
+        all_results = [rows[index]["prediction"] for index in range(num_items)]
+        self.stats.failed_items = [
+            {"index": index, "error": row["error"]} for index, row in sorted(rows.items()) if row["status"] != STATUS_OK
+        ]
+        if self.checkpoint_dir is None:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
         return all_results
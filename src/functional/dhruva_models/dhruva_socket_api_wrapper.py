@@ -1,14 +1,36 @@
+import os
 import time
+import asyncio
+import hashlib
 import logging
+import threading
+from typing import List, Union
 
 import socketio
-import datasets
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
+from .stats import InferenceStats, StreamTimings
+from .cache import ResponseCache
+from .rate_limiter import TokenBucket
+from .routing import EndpointRouter
+from .runtime import InferenceRuntime
+from .pacing import Pacer
+from .audio import pcm_wav_slices
+from dhruva_logger import logger
+
 BATCH_LEN = 5
-feature = datasets.Audio()
+
+
+def _audio_digest(audio: dict) -> str:
+    if audio.get("bytes") is not None:
+        return hashlib.sha256(audio["bytes"]).hexdigest()
+    return hashlib.sha256(np.ascontiguousarray(audio["array"]).tobytes()).hexdigest()
+
+
+def _audio_seconds(audio: dict) -> float:
+    return len(audio["array"]) / audio["sampling_rate"]
 
 
 def generate_asr_task_sequence():
@@ -51,6 +73,15 @@ def generate_nmt_task_sequence(batch_data: list, input_column: str):
     # return payload.dict()
 
 
+def _audio_slices(audio: dict, chunk_ms: int = 2000):
+    """
+    Yields:
+        `bytes`: 16 kHz WAV file of the next `chunk_ms` slice of a decoded utterance, whatever its own rate.
+        `float`: duration of the slice in seconds.
+    """
+    return pcm_wav_slices(audio["array"], audio["sampling_rate"], chunk_ms)
+
+
 class DhruvaStreamingClient:
     def __init__(
         self,
@@ -59,6 +90,7 @@ class DhruvaStreamingClient:
         api_key: str,
         task_sequence: list,
         auto_start: bool = False,
+        timeout: float = 90.0,
     ) -> None:
         # Default ASR settings
         self.input_audio__streaming_rate = 640
@@ -75,16 +107,27 @@ class DhruvaStreamingClient:
         self.audio_stream = None
         self.is_speaking = True
         self.is_stream_inactive = False
+        self.timeout = timeout
+        self.timings = StreamTimings()
+        # Responses are partial hypotheses until the end of the utterance has been signalled
+        self.awaiting_final = False
+        self.parsed_response = ""
+        # Latest response of the utterance, the fallback when the stream ends without a final one
+        self.last_response = None
+        # Set by the socket handlers once the server is ready, and once the final response is in
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.ready_at = None
 
         self.socket_client = self._get_client(on_ready=False)
 
+        self.connect_started_at = time.monotonic()
         self.socket_client.connect(
             url=socket_url,
             transports=["websocket", "polling"],
             auth={"authorization": api_key},
         )
         self.service_id = service_id
-        self.parsed_response = ""
 
     def response_handler(self, response):
         task = ""
@@ -115,18 +158,30 @@ class DhruvaStreamingClient:
         def ready():
             self.is_stream_inactive = False
             print("Server ready to receive data from client")
+            self.ready_at = time.monotonic()
+            self.ready.set()
             if on_ready:
                 on_ready()
 
         @sio.on("response")
         def response(response, response_type):
             print("response: ", response, response_type)
-            if self.is_stream_inactive:
-                self.response_handler(response)
+            self.last_response = response
+            # Partials of slices sent before the end of the utterance may still be on their way
+            if not self.awaiting_final or self.timings.pending_chunks:
+                self.timings.partial()
+                return
+            self.timings.final()
+            self.response_handler(response)
+            self.done.set()
 
         @sio.on("terminate")
         def terminate():
             print("terminate")
+            if not self.done.is_set() and self.last_response is not None:
+                # Terminated before the final response, keep the latest hypothesis
+                self.response_handler(self.last_response)
+            self.done.set()
             sio.disconnect()
 
         @sio.event
@@ -149,30 +204,33 @@ class DhruvaStreamingClient:
     def send_nmt_payload(self, data):
         pass
 
-    def send_file(self, data):
-        stream_duration = 2
-        frequency = 16000
-
-        slices = np.arange(0, len(data["audio"]["array"]) / 16000, stream_duration, dtype=np.int)
-        if slices[-1] < len(data["audio"]["array"]) / 16000:
-            slices = np.append(slices, len(data["audio"]["array"]) / 16000)
-
-        for start, end in zip(slices[:-1], slices[1:]):
-            start_audio = start * frequency
-            end_audio = end * frequency
-            audio_slice = data["audio"]["array"][int(start_audio) : int(end_audio)]
-            chunk = feature.encode_example(
-                {
-                    "array": audio_slice,
-                    "path": data["audio"]["path"],
-                    "sampling_rate": frequency,
-                }
-            )
-
+    def wait_ready(self) -> float:
+        """Wait for the server to accept the task sequence. Returns the seconds the connection took to set up."""
+        if not self.ready.wait(self.timeout):
+            raise TimeoutError("Server did not get ready")
+        return self.ready_at - self.connect_started_at
+
+    def send_file(self, data, chunk_ms: int = 2000, pacing: float = 1.0, keep_alive: bool = False):
+        """
+        Stream an utterance and wait for its final response, at most `timeout` seconds.
+        With `keep_alive` the stream stays open for the next utterance, the server state is cleared instead.
+        """
+        self.wait_ready()
+        self.parsed_response = ""
+        self.last_response = None
+        self.timings = StreamTimings()
+        self.awaiting_final = False
+        self.done.clear()
+        pacer = Pacer(pacing)
+        pacer.start()
+        self.timings.start()
+        for chunk, slice_seconds in _audio_slices(data["audio"], chunk_ms):
             clear_server_state = not self.is_speaking
             streaming_config = {"response_depth": self.task_sequence__intermediate_response_depth}
-            input_data = {"audio": [{"audioContent": chunk["bytes"]}]}
+            input_data = {"audio": [{"audioContent": chunk}]}
 
+            # Counted before it is sent, so its partial can't arrive first
+            self.timings.chunk_sent()
             self.socket_client.emit(
                 "data",
                 data=(
@@ -182,14 +240,26 @@ class DhruvaStreamingClient:
                     self.is_stream_inactive,
                 ),
             )
-            time.sleep(2)
+            pacer.wait(slice_seconds)
 
-        self._transmit_end_of_stream()
-        time.sleep(2)
+        if keep_alive:
+            self._clear_server_state()
+        else:
+            self._transmit_end_of_stream()
+        self.done.wait(self.timeout)
+
+    def _clear_server_state(self) -> None:
+        # Convey that the utterance is over without closing the stream
+        self.timings.end_of_speech()
+        self.awaiting_final = True
+        self.socket_client.emit("data", (None, None, True, self.is_stream_inactive))
 
     def _transmit_end_of_stream(self) -> None:
         # Convey that speaking has stopped
         clear_server_state = not self.is_speaking
+        self.timings.end_of_speech()
+        # Set before the emit, the final response may arrive before it returns
+        self.awaiting_final = True
         self.socket_client.emit("data", (None, None, clear_server_state, self.is_stream_inactive))
         # Convey that we can close the stream safely
         self.is_stream_inactive = True
@@ -197,56 +267,387 @@ class DhruvaStreamingClient:
         print("Terminated")
 
 
+class AsyncStreamingSession:
+    """
+    Utterances streamed over a `socketio.AsyncClient`. Unlike `DhruvaStreamingClient`, all of
+    its state lives on the instance and completion is awaited on events, so many sessions can
+    run side by side on one event loop. A session streams one utterance, or several in a row
+    when it is kept alive between them.
+    """
+
+    def __init__(self, socket_url: str, api_key: str, task_sequence: list, timeout: float = 90.0):
+        self.socket_url = socket_url
+        self.api_key = api_key
+        self.task_sequence = task_sequence
+        self.timeout = timeout
+        self.bytes_per_sample = 2
+        self.response_depth = 1  # ASR
+
+        self.is_stream_inactive = False
+        self.awaiting_final = False
+        self.parsed_response = None
+        # Latest response of the utterance, the fallback when the stream ends without a final one
+        self.last_response = None
+        self.timings = StreamTimings()
+        self.ready = asyncio.Event()
+        self.done = asyncio.Event()
+        self.ready_at = None
+
+        self.client = socketio.AsyncClient(reconnection_attempts=5)
+        self.client.on("connect", self._on_connect)
+        self.client.on("connect-success", self._on_ready)
+        self.client.on("response", self._on_response)
+        self.client.on("terminate", self._on_terminate)
+
+    async def _on_connect(self):
+        await self.client.emit("start", data=(self.task_sequence))
+
+    async def _on_ready(self):
+        self.ready_at = time.monotonic()
+        self.ready.set()
+
+    def _parse_response(self, response):
+        task = self.task_sequence[-1]["taskType"]
+        try:
+            self.parsed_response = globals()[f"parse_{task}_response"](response)
+        except Exception as e:
+            logger.error(f"Could not parse the final response: {e!r}")
+
+    async def _on_response(self, response, response_type):
+        self.last_response = response
+        # Partials of slices sent before the end of the utterance may still be on their way
+        if not self.awaiting_final or self.timings.pending_chunks:
+            self.timings.partial()
+            return
+        self.timings.final()
+        self._parse_response(response)
+        self.done.set()
+
+    async def _on_terminate(self):
+        if not self.done.is_set() and self.last_response is not None:
+            # Terminated before the final response, keep the latest hypothesis
+            self._parse_response(self.last_response)
+        self.done.set()
+
+    async def _emit_data(self, input_data, streaming_config, clear_server_state: bool):
+        await self.client.emit("data", data=(input_data, streaming_config, clear_server_state, self.is_stream_inactive))
+
+    @property
+    def connected(self) -> bool:
+        return self.client.connected and not self.is_stream_inactive
+
+    async def connect(self) -> float:
+        """Connect and wait for the server to get ready. Returns the seconds the connection took to set up."""
+        connect_started_at = time.monotonic()
+        await self.client.connect(
+            url=self.socket_url,
+            transports=["websocket", "polling"],
+            auth={"authorization": self.api_key},
+        )
+        await asyncio.wait_for(self.ready.wait(), self.timeout)
+        return self.ready_at - connect_started_at
+
+    async def stream(self, data: dict, chunk_ms: int = 2000, pacing: float = 1.0, keep_alive: bool = False):
+        """
+        Stream an utterance and wait for its final response. Returns the parsed response.
+        With `keep_alive` the stream stays open for the next utterance, the server state is cleared instead.
+        """
+        self.parsed_response = None
+        self.last_response = None
+        self.timings = StreamTimings()
+        self.awaiting_final = False
+        self.done.clear()
+        streaming_config = {"response_depth": self.response_depth}
+        pacer = Pacer(pacing)
+        pacer.start()
+        self.timings.start()
+        for chunk, slice_seconds in _audio_slices(data["audio"], chunk_ms):
+            # Counted before it is sent, so its partial can't arrive first
+            self.timings.chunk_sent()
+            await self._emit_data({"audio": [{"audioContent": chunk}]}, streaming_config, False)
+            await pacer.wait_async(slice_seconds)
+
+        self.timings.end_of_speech()
+        # Set before the emits, the final response may arrive before they return
+        self.awaiting_final = True
+        if keep_alive:
+            await self._emit_data(None, None, True)
+        else:
+            # Speaking has stopped, then the stream can be closed
+            await self._emit_data(None, None, False)
+            self.is_stream_inactive = True
+            await self._emit_data(None, None, False)
+        await asyncio.wait_for(self.done.wait(), self.timeout)
+        return self.parsed_response
+
+    async def close(self):
+        await self.client.disconnect()
+
+
 class DhruvaSocketModel:
     def __init__(
         self,
         task: str,
-        url: str,
+        url: Union[str, List[str]],
         service_id: str,
         input_column: str,
         api_key: str,
         source_language: str,
         target_language: str,
+        cache: dict = None,
+        max_rps: float = None,
+        burst: int = 1,
+        routing: str = "round_robin",
+        engine: str = "process",
+        max_in_flight: int = 8,
+        retry: dict = None,
+        streaming: dict = None,
+        runtime: InferenceRuntime = None,
+        errors_path: str = "errors.csv",
         **kwargs,
     ):
         self.task = task
-        self.url = url
+        self.urls = [url] if isinstance(url, str) else list(url)
+        # The rate limit and router of a suite's runtime are shared by all of its subsets
+        self.router = runtime.router if runtime is not None else EndpointRouter(self.urls, routing)
+        self.cache_namespace = " ".join(sorted(self.urls))
         self.service_id = service_id
         self.input_column = input_column
         self.api_key = api_key
         self.source_language = source_language
         self.target_language = target_language
-
-    def _infer(self, data):
+        self.stats = InferenceStats()
+        self.cache = ResponseCache(**(cache or {}))
+        if runtime is not None:
+            self.rate_limiter = runtime.rate_limiter
+        else:
+            self.rate_limiter = TokenBucket(max_rps, burst) if max_rps else None
+        # Called with (indices, outputs) as utterances complete, e.g. by an evaluator's running metric
+        self.on_predictions = None
+        # "async" streams up to max_in_flight utterances at once from one event loop,
+        # anything else streams them one at a time
+        self.engine = engine
+        self.max_in_flight = max_in_flight
+        # Seconds to wait for the server to get ready, and for the final response
+        self.timeout = (retry or {}).get("timeout", 90.0)
+        streaming = streaming or {}
+        # Slice length, and speed relative to real time (None to send slices as fast as possible)
+        self.chunk_ms = streaming.get("chunk_ms", 2000)
+        self.pacing = streaming.get("pacing", 1.0)
+        # Keep one session per endpoint open across utterances, clearing the server state between them
+        self.reuse_session = streaming.get("reuse_session", False)
+        # Open sessions of the sync engine by endpoint URL, when reused
+        self._sessions = {}
+        # Paths of the utterances that failed, one file per subset
+        self.errors_path = errors_path
+
+    def _task_sequence(self):
         task_sequence = globals()[f"generate_{self.task}_task_sequence"]()
         # support multiple tasks in a sequence when needed
         task_sequence[0]["config"]["serviceId"] = self.service_id
+        return task_sequence
+
+    def _read_cache(self, task_sequence, data):
+        """
+        Returns:
+            `str`: cache key of the utterance, `None` when the cache is off.
+            cached response, `None` on a miss.
+        """
+        if not self.cache.enabled:
+            return None, None
+        cache_key = ResponseCache.make_key(self.cache_namespace, task_sequence, _audio_digest(data["audio"]))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.stats.cache_hits += 1
+        else:
+            self.stats.cache_misses += 1
+        return cache_key, cached
+
+    async def _infer_async(self, data, sessions: dict = None):
+        """
+        Args:
+            sessions (`dict`): open sessions of the calling worker by endpoint URL, reused and
+                kept open when given, else the utterance gets a session of its own.
+        """
+        task_sequence = self._task_sequence()
+        cache_key, cached = self._read_cache(task_sequence, data)
+        if cached is not None:
+            return cached
+
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async()
+        url = self.router.acquire()
+        self.stats.mark_request()
+        self.stats.requests += 1
+        keep_alive = sessions is not None
+        session = sessions.get(url) if keep_alive else None
+        start, parsed_response = time.time(), None
+        try:
+            if session is not None and session.connected:
+                self.stats.connections_reused += 1
+            else:
+                session = AsyncStreamingSession(url, self.api_key, task_sequence, timeout=self.timeout)
+                if keep_alive:
+                    sessions[url] = session
+                self.stats.connections_opened += 1
+                self.stats.record_connection(await session.connect())
+            # Connection setup is reported on its own, the utterance latency starts here
+            start = time.time()
+            parsed_response = await session.stream(data, self.chunk_ms, self.pacing, keep_alive)
+        finally:
+            if not keep_alive or not parsed_response:
+                await session.close()
+                if keep_alive:
+                    sessions.pop(url, None)
+            latency = time.time() - start
+            self.stats.record_stream(_audio_seconds(data["audio"]), latency, session.timings)
+            self.router.release(url, latency, bool(parsed_response))
+            self.stats.record_request(
+                latency,
+                len(data["audio"]["array"]) * session.bytes_per_sample,
+                1,
+                bool(parsed_response),
+                endpoint=url,
+            )
+        if cache_key is not None and parsed_response:
+            self.cache.set(cache_key, parsed_response)
+        return parsed_response
+
+    async def _infer_all_async(self, all_audios):
+        """
+        Stream up to max_in_flight utterances at once.
+        Returns:
+            `dict`: outputs of every utterance by dataset index, `[None]` for failures.
+            `list`: paths of the failed utterances.
+        """
+        items = enumerate(all_audios)
+        items_lock = asyncio.Lock()
+        outputs, errors = {}, []
+        progress = tqdm()
+
+        async def next_item():
+            # Reading (and decoding) the next utterance is kept off the event loop
+            async with items_lock:
+                return await asyncio.to_thread(next, items, None)
+
+        async def worker():
+            sessions = {} if self.reuse_session else None
+            while (item := await next_item()) is not None:
+                index, audio = item
+                try:
+                    result = await self._infer_async(audio, sessions)
+                    if not result:
+                        raise ValueError("No final response received")
+                    outputs[index] = result
+                    if self.on_predictions is not None:
+                        self.on_predictions([index], result)
+                except Exception as e:
+                    logger.error(f"Utterance {index} failed: {e!r}")
+                    errors.append(audio["audio"]["path"])
+                    outputs[index] = [None]
+                    self.stats.failed_items.append({"index": index, "error": repr(e)})
+                progress.update(1)
+            for session in (sessions or {}).values():
+                await session.close()
+
+        await asyncio.gather(*[worker() for _ in range(self.max_in_flight)])
+        progress.close()
+        return outputs, errors
 
-        streamer = DhruvaStreamingClient(
-            socket_url=self.url,
-            service_id=self.service_id,
-            api_key=self.api_key,
-            task_sequence=task_sequence,
-            auto_start=False,
+    def _infer(self, data):
+        task_sequence = self._task_sequence()
+        cache_key, cached = self._read_cache(task_sequence, data)
+        if cached is not None:
+            return cached
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        url = self.router.acquire()
+        self.stats.mark_request()
+        keep_alive = self.reuse_session
+        streamer = self._sessions.get(url) if keep_alive else None
+        start = time.time()
+        try:
+            if streamer is not None and streamer.socket_client.connected:
+                self.stats.connections_reused += 1
+            else:
+                streamer = DhruvaStreamingClient(
+                    socket_url=url,
+                    service_id=self.service_id,
+                    api_key=self.api_key,
+                    task_sequence=task_sequence,
+                    auto_start=False,
+                    timeout=self.timeout,
+                )
+                if keep_alive:
+                    self._sessions[url] = streamer
+                self.stats.connections_opened += 1
+                self.stats.record_connection(streamer.wait_ready())
+            self.stats.requests += 1
+            # Connection setup is reported on its own, the utterance latency starts here
+            start = time.time()
+            streamer.send_file(data, self.chunk_ms, self.pacing, keep_alive)
+        except Exception:
+            self.router.release(url, time.time() - start, False)
+            raise
+        finally:
+            # A session that failed or missed its final response is not reused
+            if streamer is not None and (not keep_alive or not streamer.parsed_response):
+                streamer.force_disconnect()
+                self._sessions.pop(url, None)
+
+        latency = time.time() - start
+        self.stats.record_stream(_audio_seconds(data["audio"]), latency, streamer.timings)
+        self.router.release(url, latency, bool(streamer.parsed_response))
+        self.stats.record_request(
+            latency,
+            len(data["audio"]["array"]) * streamer.input_audio__bytes_per_sample,
+            1,
+            bool(streamer.parsed_response),
+            endpoint=url,
         )
-        streamer.send_file(data)
-        while True:
-            if not hasattr(streamer, "parsed_response"):
-                time.sleep(1)
-                continue
-            break
-
+        if cache_key is not None and streamer.parsed_response:
+            self.cache.set(cache_key, streamer.parsed_response)
         return streamer.parsed_response
 
     def __call__(self, all_audios, **kwargs):
+        self.stats = InferenceStats()
+        try:
+            return self._run(all_audios)
+        finally:
+            for streamer in self._sessions.values():
+                streamer.force_disconnect()
+            self._sessions = {}
+
+    def _run(self, all_audios):
+        if self.engine == "async":
+            outputs, errors = asyncio.run(self._infer_all_async(all_audios))
+            # Back in dataset order
+            all_results = [output for index in sorted(outputs) for output in outputs[index]]
+            self._write_errors(errors)
+            return all_results
+
         all_results = []
         errors = []
-        for audio in tqdm(all_audios):
+        for index, audio in enumerate(tqdm(all_audios)):
             try:
-                all_results.extend(self._infer(audio))
+                result = self._infer(audio)
+                if not result:
+                    raise ValueError("No final response received")
+                all_results.extend(result)
+                if self.on_predictions is not None:
+                    self.on_predictions([index], result)
             except Exception as e:
                 print("exception: ", str(e))
                 errors.append(audio["audio"]["path"])
+                # keep later predictions aligned with the dataset
+                all_results.append(None)
+                self.stats.failed_items.append({"index": index, "error": repr(e)})
 
-        pd.DataFrame(errors).to_csv("errors.csv")
+        self._write_errors(errors)
         return all_results
+
+    def _write_errors(self, errors: List[str]):
+        if os.path.dirname(self.errors_path):
+            os.makedirs(os.path.dirname(self.errors_path), exist_ok=True)
+        pd.DataFrame(errors).to_csv(self.errors_path)
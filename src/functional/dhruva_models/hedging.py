@@ -0,0 +1,51 @@
+from collections import deque
+
+import numpy as np
+
+
+class HedgePolicy:
+    """
+    Decides when a slow request gets a duplicate.
+    Once `min_samples` requests have succeeded, a request still running after the
+    `percentile` latency of the last `window` successful requests is sent once more, as
+    long as duplicates stay within `budget` (a fraction of the requests sent). Every worker
+    keeps its own latency window and budget.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95,
+        budget: float = 0.05,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+
+    def record(self, latency: float):
+        """Latency of a successful request"""
+        self.latencies.append(latency)
+
+    def delay(self):
+        """
+        Counts a new request.
+        Returns:
+            `float`: seconds after which the request may be hedged, `None` if it may not.
+        """
+        self.requests += 1
+        if not self.enabled or len(self.latencies) < self.min_samples:
+            return None
+        return float(np.percentile(self.latencies, self.percentile))
+
+    def spend(self) -> bool:
+        """Take one hedge from the budget, False once it is used up"""
+        if self.hedges + 1 > self.budget * self.requests:
+            return False
+        self.hedges += 1
+        return True
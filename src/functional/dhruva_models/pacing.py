@@ -0,0 +1,33 @@
+import time
+import asyncio
+
+
+class Pacer:
+    """
+    Paces the slices of an audio stream at `speed` times real time, 1 for real time and e.g. 4
+    for four times faster. Every slice has a deadline counted from the start of the stream, so
+    time spent encoding and sending a slice is taken out of the next wait instead of adding up.
+    With no `speed` (None or 0) slices are sent as fast as possible.
+    """
+
+    def __init__(self, speed: float = 1.0):
+        self.speed = speed
+        self.audio_sent = 0.0
+        self.started_at = None
+
+    def start(self):
+        self.audio_sent = 0.0
+        self.started_at = time.monotonic()
+
+    def _delay(self, slice_seconds: float) -> float:
+        """Account for a slice that was just sent. Returns the seconds to wait before the next one."""
+        self.audio_sent += slice_seconds
+        if not self.speed:
+            return 0.0
+        return max(0.0, self.started_at + self.audio_sent / self.speed - time.monotonic())
+
+    def wait(self, slice_seconds: float):
+        time.sleep(self._delay(slice_seconds))
+
+    async def wait_async(self, slice_seconds: float):
+        await asyncio.sleep(self._delay(slice_seconds))
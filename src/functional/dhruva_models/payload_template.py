@@ -0,0 +1,56 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(body: bytes):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class PayloadTemplate:
+    """
+    Request body of one (task, language) stream, validated and serialised once.
+    Built from a payload that went through the pydantic request schema, every later batch
+    only serialises its own values into the pre-encoded config and item fragments.
+    Values given as `bytes` (base64 audio) are spliced in as they are, without being
+    decoded or scanned by the JSON encoder.
+    """
+
+    _ITEMS_PLACEHOLDER = "__DHRUVA_ITEMS__"
+    _VALUE_PLACEHOLDER = "__DHRUVA_VALUE__"
+
+    def __init__(self, validated_payload: dict, items_key: str, value_key: str):
+        self.items_key = items_key
+        self.value_key = value_key
+        self.config = {key: value for key, value in validated_payload.items() if key != items_key}
+
+        body = dumps({**validated_payload, items_key: self._ITEMS_PLACEHOLDER})
+        self._prefix, self._suffix = body.split(dumps(self._ITEMS_PLACEHOLDER))
+        item = dumps({**validated_payload[items_key][0], value_key: self._VALUE_PLACEHOLDER})
+        self._item_prefix, self._item_suffix = item.split(dumps(self._VALUE_PLACEHOLDER))
+
+    def payload(self, values: list) -> dict:
+        return {**self.config, self.items_key: [{self.value_key: value} for value in values]}
+
+    def _encode_value(self, value) -> bytes:
+        if isinstance(value, bytes):
+            return b'"' + value + b'"'
+        return dumps(value)
+
+    def render(self, payload: dict) -> bytes:
+        items = b",".join(
+            self._item_prefix + self._encode_value(item[self.value_key]) + self._item_suffix
+            for item in payload[self.items_key]
+        )
+        return self._prefix + b"[" + items + b"]" + self._suffix
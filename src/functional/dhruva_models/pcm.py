@@ -0,0 +1,69 @@
+"""
+16-bit PCM WAV slices built without an audio library, so the Locust users under
+src/performance can import this module on its own as well.
+"""
+import struct
+
+import numpy as np
+
+
+def to_pcm16(array) -> memoryview:
+    """
+    Little-endian 16-bit PCM bytes of an array of samples, converted in one pass.
+    Float samples are taken in [-1, 1], integer samples are rescaled from their own width
+    (e.g. int32, uint8) and (frames, channels) arrays are downmixed to mono.
+    """
+    array = np.asarray(array)
+    if array.ndim > 2:
+        raise ValueError(f"Expected (frames,) or (frames, channels) samples, got shape {array.shape}")
+    if array.dtype.kind in "iu" and array.dtype != np.int16:
+        bits = 8 * array.dtype.itemsize
+        scaled = array.astype(np.int64)
+        if array.dtype.kind == "u":
+            # Unsigned PCM (8-bit WAV) is centred on half its range
+            scaled -= 1 << (bits - 1)
+        scaled = scaled >> (bits - 16) if bits > 16 else scaled << (16 - bits)
+        array = scaled.astype(np.int16)
+    elif array.dtype.kind == "f":
+        array = (np.clip(array, -1.0, 1.0) * 32767).astype(np.int16)
+    if array.ndim == 2:
+        array = array.mean(axis=1).astype(np.int16)
+    return memoryview(np.ascontiguousarray(array, dtype="<i2")).cast("B")
+
+
+def wav_header(num_samples: int, sampling_rate: int) -> bytes:
+    """44 byte RIFF header of a mono 16-bit PCM WAV with `num_samples` samples"""
+    data_size = 2 * num_samples
+    # RIFF chunk, fmt chunk (PCM, mono, byte rate, block align, bits per sample), data chunk
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        1,
+        sampling_rate,
+        2 * sampling_rate,
+        2,
+        16,
+        b"data",
+        data_size,
+    )
+
+
+def wav_slices(pcm: memoryview, sampling_rate: int, chunk_ms: int = 2000):
+    """
+    Split PCM bytes into WAV files of `chunk_ms` each. Slices are memoryviews over `pcm`, and only
+    the header of the last, shorter slice differs from the others.
+    Yields:
+        `bytes`: WAV file of the next slice.
+        `float`: duration of the slice in seconds.
+    """
+    slice_bytes = 2 * int(chunk_ms * sampling_rate / 1000)
+    full_header = wav_header(slice_bytes // 2, sampling_rate)
+    for start in range(0, len(pcm), slice_bytes):
+        samples = pcm[start : start + slice_bytes]
+        header = full_header if len(samples) == slice_bytes else wav_header(len(samples) // 2, sampling_rate)
+        yield b"".join((header, samples)), len(samples) / (2 * sampling_rate)
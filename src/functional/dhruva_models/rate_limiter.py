@@ -0,0 +1,33 @@
+import time
+import asyncio
+import multiprocessing as mp
+
+
+class TokenBucket:
+    """
+    Client-side rate limit shared by every worker process and coroutine of a run.
+    The bucket state lives in shared memory, so it has to reach worker processes through
+    inheritance (a Pool initializer), not by pickling.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._lock = mp.Lock()
+        self._tokens = mp.RawValue("d", self.burst)
+        self._updated_at = mp.RawValue("d", time.monotonic())
+
+    def _reserve(self) -> float:
+        """Take a token, going into debt if none is left. Returns the seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._tokens.value + (now - self._updated_at.value) * self.rate) - 1
+            self._tokens.value = tokens
+            self._updated_at.value = now
+        return 0.0 if tokens >= 0 else -tokens / self.rate
+
+    def acquire(self):
+        time.sleep(self._reserve())
+
+    async def acquire_async(self):
+        await asyncio.sleep(self._reserve())
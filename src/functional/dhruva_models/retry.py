@@ -0,0 +1,59 @@
+import random
+import asyncio
+
+import aiohttp
+import requests
+
+
+class ServiceError(Exception):
+    """The service answered with a status code that carries no usable output"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Service responded with HTTP {status_code}")
+        self.status_code = status_code
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter for failed requests.
+    Connection errors, 429 and 5xx are retried in place. Timeouts and unusable responses
+    fail the batch straight away so a stuck request doesn't hold up the rest of the shard;
+    its items are retried one at a time at the end of the run.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        timeout: float = 90.0,
+        final_pass: bool = True,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.final_pass = final_pass
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    @staticmethod
+    def is_timeout(error: Exception) -> bool:
+        return isinstance(error, (requests.Timeout, asyncio.TimeoutError))
+
+    @staticmethod
+    def is_overloaded(error: Exception) -> bool:
+        """Signals that the batch was too large or the service is saturated"""
+        if isinstance(error, ServiceError):
+            return error.status_code >= 500 or error.status_code == 413
+        return RetryPolicy.is_timeout(error)
+
+    def should_retry(self, error: Exception, attempt: int, retry_timeouts: bool = False) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, ServiceError):
+            return error.status_code >= 500 or error.status_code == 429
+        if isinstance(error, (requests.ConnectionError, aiohttp.ClientConnectionError)):
+            return not self.is_timeout(error) or retry_timeouts
+        return retry_timeouts and self.is_timeout(error)
@@ -0,0 +1,68 @@
+import random
+import multiprocessing as mp
+from typing import List
+
+
+class EndpointRouter:
+    """
+    Spreads requests over replicas of the same service.
+    Outstanding requests and smoothed latencies live in shared memory so every worker process
+    routes on the same view; like the rate limiter it reaches the workers through the Pool
+    initializer, not by pickling.
+    """
+
+    STRATEGIES = ("round_robin", "least_outstanding", "latency_weighted")
+    # Weight of the newest sample in the smoothed latency
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, urls: List[str], strategy: str = "round_robin"):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown routing strategy {strategy!r}, expected one of {self.STRATEGIES}")
+        self.urls = list(urls)
+        self.strategy = strategy
+        self._lock = mp.Lock()
+        self._next = mp.RawValue("L", 0)
+        self._outstanding = mp.RawArray("i", len(self.urls))
+        self._latency = mp.RawArray("d", len(self.urls))
+
+    def _pick(self) -> int:
+        if self.strategy == "round_robin" or len(self.urls) == 1:
+            picked = self._next.value % len(self.urls)
+            self._next.value += 1
+            return picked
+        if self.strategy == "least_outstanding":
+            # Ties are broken round robin so idle replicas share the load
+            start = self._next.value % len(self.urls)
+            self._next.value += 1
+            order = [(start + offset) % len(self.urls) for offset in range(len(self.urls))]
+            return min(order, key=lambda i: self._outstanding[i])
+        # latency_weighted: replicas without a sample yet are tried first, then each replica is
+        # picked with a probability inversely proportional to its expected wait, i.e. smoothed
+        # latency scaled by the requests already queued on it. Slow replicas keep getting a
+        # share of the traffic, so their latency estimate stays current.
+        unsampled = [i for i in range(len(self.urls)) if self._latency[i] == 0]
+        if unsampled:
+            return min(unsampled, key=lambda i: self._outstanding[i])
+        weights = [1 / (self._latency[i] * (1 + self._outstanding[i])) for i in range(len(self.urls))]
+        return random.choices(range(len(self.urls)), weights=weights)[0]
+
+    def acquire(self) -> str:
+        """Pick an endpoint for the next request, it has to be given back with `release`"""
+        with self._lock:
+            picked = self._pick()
+            self._outstanding[picked] += 1
+        return self.urls[picked]
+
+    def release(self, url: str, latency: float, success: bool):
+        """Give back an endpoint. A `latency` of None, e.g. for a cancelled request, leaves its smoothed latency as is."""
+        picked = self.urls.index(url)
+        with self._lock:
+            self._outstanding[picked] -= 1
+            if latency is None:
+                return
+            previous = self._latency[picked]
+            # A failed request counts as twice the usual latency, so flaky replicas get less traffic
+            sample = latency if success else max(latency, 2 * previous)
+            self._latency[picked] = (
+                sample if previous == 0 else (1 - self.EWMA_ALPHA) * previous + self.EWMA_ALPHA * sample
+            )
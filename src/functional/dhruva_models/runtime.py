@@ -0,0 +1,142 @@
+import time
+import asyncio
+import threading
+import multiprocessing as mp
+from typing import List
+from collections import OrderedDict
+
+import aiohttp
+
+from .rate_limiter import TokenBucket
+from .routing import EndpointRouter
+
+# Rate limiter and router inherited by the worker processes of the pool
+_WORKER_RATE_LIMITER = None
+_WORKER_ROUTER = None
+# Copies of the models a worker runs chunks with, by run id, so batch sizing and hedging
+# state carry over from one chunk of a run to the next
+_WORKER_MODELS = OrderedDict()
+MAX_WORKER_MODELS = 16
+
+
+def _init_worker(rate_limiter: TokenBucket, router: EndpointRouter):
+    global _WORKER_RATE_LIMITER, _WORKER_ROUTER
+    _WORKER_RATE_LIMITER = rate_limiter
+    _WORKER_ROUTER = router
+
+
+def worker_rate_limiter() -> TokenBucket:
+    return _WORKER_RATE_LIMITER
+
+
+def worker_router() -> EndpointRouter:
+    return _WORKER_ROUTER
+
+
+def run_chunk(model, chunk):
+    """Pool task: run a chunk with this worker's copy of the model"""
+    worker_model = _WORKER_MODELS.get(model.run_id)
+    if worker_model is None:
+        worker_model = _WORKER_MODELS[model.run_id] = model
+        if len(_WORKER_MODELS) > MAX_WORKER_MODELS:
+            _WORKER_MODELS.popitem(last=False)
+    return worker_model.infer_chunk(chunk)
+
+
+class RequestTrace:
+    """`trace_request_ctx` of one request: its connection is counted on `stats`"""
+
+    def __init__(self, stats):
+        self.stats = stats
+        # Wall-clock time the request got a connection, when it had to wait for one
+        self.dequeued_at = None
+
+
+async def _on_connection_queued_end(session, trace_config_ctx, params):
+    if trace_config_ctx.trace_request_ctx is not None:
+        trace_config_ctx.trace_request_ctx.dequeued_at = time.time()
+
+
+async def _on_connection_create_end(session, trace_config_ctx, params):
+    if trace_config_ctx.trace_request_ctx is not None:
+        trace_config_ctx.trace_request_ctx.stats.connections_opened += 1
+
+
+async def _on_connection_reuseconn(session, trace_config_ctx, params):
+    if trace_config_ctx.trace_request_ctx is not None:
+        trace_config_ctx.trace_request_ctx.stats.connections_reused += 1
+
+
+class InferenceRuntime:
+    """
+    Worker processes, event loop, HTTP session and shared limits of the REST models. The pool
+    and loop are started on first use and outlive a single evaluation, so every subset of a
+    suite runs on warm workers and connections. Call `close` once done.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        routing: str = "round_robin",
+        max_rps: float = None,
+        burst: int = 1,
+        pool_size: int = 10,
+        num_processes: int = None,
+        max_connections: int = None,
+    ):
+        self.rate_limiter = TokenBucket(max_rps, burst) if max_rps else None
+        self.router = EndpointRouter(urls, routing)
+        self.pool_size = pool_size
+        # Open connections of the async engine's session, None for no limit
+        self.max_connections = max_connections
+        self.num_processes = num_processes or mp.cpu_count()
+        self._pool = None
+        self._loop = None
+        self._loop_thread = None
+        self._http_session = None
+        self._lock = threading.Lock()
+
+    def pool(self) -> mp.Pool:
+        with self._lock:
+            if self._pool is None:
+                self._pool = mp.Pool(
+                    processes=self.num_processes,
+                    initializer=_init_worker,
+                    initargs=(self.rate_limiter, self.router),
+                )
+            return self._pool
+
+    def run_async(self, coroutine):
+        """Run a coroutine on the runtime's event loop, from any thread, and wait for its result"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def http_session(self) -> aiohttp.ClientSession:
+        """Keep-alive session of the event loop. Connections are counted on the `RequestTrace` of a request."""
+        if self._http_session is None:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_queued_end.append(_on_connection_queued_end)
+            trace_config.on_connection_create_end.append(_on_connection_create_end)
+            trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+            self._http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections or 0), trace_configs=[trace_config]
+            )
+        return self._http_session
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._loop is not None:
+            if self._http_session is not None:
+                self.run_async(self._http_session.close())
+                self._http_session = None
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = None
@@ -0,0 +1,250 @@
+import time
+from collections import deque
+
+import numpy as np
+
+
+def _latency_ms(latencies):
+    """Percentiles in milliseconds of latencies in seconds, None when there are none"""
+    if len(latencies) == 0:
+        return None
+    latencies = 1000 * np.asarray(latencies)
+    return {
+        "p50": float(np.percentile(latencies, 50)),
+        "p90": float(np.percentile(latencies, 90)),
+        "p99": float(np.percentile(latencies, 99)),
+        "max": float(latencies.max()),
+        "mean": float(latencies.mean()),
+    }
+
+
+class StreamTimings:
+    """
+    Timestamps of one utterance streamed over a socket. Partial hypotheses are matched to the
+    audio slices in the order they were sent; the final response is the one that comes once
+    every slice has had its partial.
+    """
+
+    def __init__(self):
+        self.started_at = None
+        self.pending_chunks = deque()
+        self.first_partial_at = None
+        self.chunk_latencies = []
+        self.partials = 0
+        self.end_of_speech_at = None
+        self.final_at = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+
+    def chunk_sent(self):
+        self.pending_chunks.append(time.monotonic())
+
+    def partial(self):
+        now = time.monotonic()
+        self.partials += 1
+        if self.first_partial_at is None:
+            self.first_partial_at = now
+        if self.pending_chunks:
+            self.chunk_latencies.append(now - self.pending_chunks.popleft())
+
+    def end_of_speech(self):
+        self.end_of_speech_at = time.monotonic()
+
+    def final(self):
+        self.final_at = time.monotonic()
+
+    @property
+    def time_to_first_partial(self):
+        if self.first_partial_at is None:
+            return None
+        return self.first_partial_at - self.started_at
+
+    @property
+    def final_latency(self):
+        """Seconds from the end of speech to the final response"""
+        if self.final_at is None or self.end_of_speech_at is None:
+            return None
+        return self.final_at - self.end_of_speech_at
+
+
+class InferenceStats:
+    """Counters collected while running inference, merged across workers"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        # Seconds from connecting to the server being ready, one entry per socket session
+        self.connection_setup = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Wall-clock time of the first and last request sent
+        self.first_request_at = None
+        self.last_request_at = None
+        self.last_response_at = None
+        # One entry per HTTP request (retries included)
+        self.latencies = []
+        self.payload_bytes = []
+        self.batch_sizes = []
+        self.request_errors = 0
+        self.items_ok = 0
+        # Duplicates sent for slow requests, and how many of them answered first
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        # Audio streamed over socket sessions, and the wall time the sessions took
+        self.audio_seconds = 0.0
+        self.stream_seconds = 0.0
+        # Streaming latencies: one entry per utterance, except chunk latencies (one per partial)
+        self.first_partial_latencies = []
+        self.chunk_latencies = []
+        self.final_latencies = []
+        self.partials = []
+        # Request latencies and error count of every endpoint (service replica)
+        self.endpoints = {}
+        # Items that still had no output after the final retry pass
+        self.failed_items = []
+        # Batch size each worker's BatchSizeController settled on, by pid
+        self.final_batch_sizes = {}
+
+    def mark_request(self):
+        now = time.time()
+        if self.first_request_at is None:
+            self.first_request_at = now
+        self.last_request_at = now
+
+    def record_request(self, latency: float, payload_bytes: int, batch_size: int, success: bool, endpoint: str = None):
+        self.latencies.append(latency)
+        if endpoint is not None:
+            endpoint_stats = self.endpoints.setdefault(endpoint, {"latencies": [], "errors": 0})
+            endpoint_stats["latencies"].append(latency)
+            endpoint_stats["errors"] += 0 if success else 1
+        self.payload_bytes.append(payload_bytes)
+        self.batch_sizes.append(batch_size)
+        self.request_errors += 0 if success else 1
+        self.items_ok += batch_size if success else 0
+        self.last_response_at = time.time()
+
+    def record_connection(self, setup_seconds: float):
+        self.connection_setup.append(setup_seconds)
+
+    def record_stream(self, audio_seconds: float, stream_seconds: float, timings: StreamTimings = None):
+        self.audio_seconds += audio_seconds
+        self.stream_seconds += stream_seconds
+        if timings is None:
+            return
+        self.partials.append(timings.partials)
+        self.chunk_latencies.extend(timings.chunk_latencies)
+        if timings.time_to_first_partial is not None:
+            self.first_partial_latencies.append(timings.time_to_first_partial)
+        if timings.final_latency is not None:
+            self.final_latencies.append(timings.final_latency)
+
+    @property
+    def achieved_rps(self):
+        if self.first_request_at is None or self.last_request_at <= self.first_request_at:
+            return None
+        return self.requests / (self.last_request_at - self.first_request_at)
+
+    def merge(self, other: "InferenceStats"):
+        self.requests += other.requests
+        self.connections_opened += other.connections_opened
+        self.connections_reused += other.connections_reused
+        self.connection_setup.extend(other.connection_setup)
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+        self.final_batch_sizes.update(other.final_batch_sizes)
+        self.failed_items.extend(other.failed_items)
+        self.latencies.extend(other.latencies)
+        self.payload_bytes.extend(other.payload_bytes)
+        self.batch_sizes.extend(other.batch_sizes)
+        self.request_errors += other.request_errors
+        self.items_ok += other.items_ok
+        self.hedges_sent += other.hedges_sent
+        self.hedges_won += other.hedges_won
+        self.audio_seconds += other.audio_seconds
+        self.stream_seconds += other.stream_seconds
+        self.first_partial_latencies.extend(other.first_partial_latencies)
+        self.chunk_latencies.extend(other.chunk_latencies)
+        self.final_latencies.extend(other.final_latencies)
+        self.partials.extend(other.partials)
+        for endpoint, other_endpoint_stats in other.endpoints.items():
+            endpoint_stats = self.endpoints.setdefault(endpoint, {"latencies": [], "errors": 0})
+            endpoint_stats["latencies"].extend(other_endpoint_stats["latencies"])
+            endpoint_stats["errors"] += other_endpoint_stats["errors"]
+        if other.first_request_at is not None:
+            self.first_request_at = min(filter(None, (self.first_request_at, other.first_request_at)))
+            self.last_request_at = max(filter(None, (self.last_request_at, other.last_request_at)))
+        if other.last_response_at is not None:
+            self.last_response_at = max(filter(None, (self.last_response_at, other.last_response_at)))
+        return self
+
+    def latency_summary(self):
+        """Latency percentiles in milliseconds, throughput in items per second"""
+        if not self.latencies:
+            return {}
+        wall_time = (self.last_response_at or 0) - (self.first_request_at or 0)
+        return {
+            "latency_ms": _latency_ms(self.latencies),
+            "payload_bytes": {
+                "total": int(sum(self.payload_bytes)),
+                "mean": float(np.mean(self.payload_bytes)),
+            },
+            "batch_size": {
+                "mean": float(np.mean(self.batch_sizes)),
+                "max": int(max(self.batch_sizes)),
+            },
+            "throughput_items_per_s": self.items_ok / wall_time if wall_time > 0 else None,
+            "error_rate": self.request_errors / len(self.latencies),
+        }
+
+    def endpoint_summary(self):
+        """Requests, errors and latency percentiles of every endpoint"""
+        return {
+            endpoint: {
+                "requests": len(endpoint_stats["latencies"]),
+                "errors": endpoint_stats["errors"],
+                "error_rate": endpoint_stats["errors"] / len(endpoint_stats["latencies"]),
+                "latency_ms": _latency_ms(endpoint_stats["latencies"]),
+            }
+            for endpoint, endpoint_stats in sorted(self.endpoints.items())
+        }
+
+    def streaming_summary(self):
+        """Real-time factor and latency percentiles of the utterances streamed over sockets"""
+        return {
+            "audio_seconds": self.audio_seconds,
+            # Session wall time per second of audio, 1 when streamed in real time
+            "rtf": self.stream_seconds / self.audio_seconds if self.audio_seconds else None,
+            "time_to_first_partial_ms": _latency_ms(self.first_partial_latencies),
+            "chunk_response_ms": _latency_ms(self.chunk_latencies),
+            "end_of_speech_to_final_ms": _latency_ms(self.final_latencies),
+            "partials_per_utterance": float(np.mean(self.partials)) if self.partials else None,
+        }
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "failed": len(self.failed_items),
+            "achieved_rps": self.achieved_rps,
+            **self.latency_summary(),
+            "endpoints": self.endpoint_summary(),
+            "streaming": self.streaming_summary(),
+            "hedging": {
+                "sent": self.hedges_sent,
+                "won": self.hedges_won,
+            },
+            "connections": {
+                "opened": self.connections_opened,
+                "reused": self.connections_reused,
+                "setup_ms": _latency_ms(self.connection_setup),
+            },
+            "cache": {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+            },
+            "batching": {
+                "final_batch_size": max(self.final_batch_sizes.values(), default=None),
+                "final_batch_size_per_worker": list(self.final_batch_sizes.values()),
+            },
+        }
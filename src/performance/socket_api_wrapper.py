@@ -1,14 +1,17 @@
-import io
 import os
+import sys
 import time
 import base64
 import json
 import gevent
 import socketio
-import numpy as np
-from scipy.io.wavfile import write, read
+from scipy.io.wavfile import read
 from locust import User, task
 
+# PCM slicing shared with the evaluation client, imported on its own (numpy only)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functional", "dhruva_models"))
+from pcm import to_pcm16, wav_slices
+
 NUM_ALLOWED_HITS = 3
 
 
@@ -46,8 +49,10 @@ class SocketIOUser(User):
         self.is_speaking = True
         self.is_stream_inactive = False
 
-        # payload file
+        # payload file, converted to PCM once and sliced per stream
         self.input_filepath = data["input_filepath"]
+        self.sampling_rate, sound = read(self.input_filepath)
+        self.pcm = to_pcm16(sound)
 
     def connect(self):
         # states
@@ -139,27 +144,13 @@ class SocketIOUser(User):
     def send_file(self):
         stream_duration = 2
 
-        input_filepath = self.input_filepath
-        sr, sound = read(input_filepath)
-        # np.array(sound, dtype=float)
-
         self.start_at = time.time()
         self.disconnected = False
-        slices = np.arange(0, len(sound) / sr, stream_duration, dtype=np.int32)
-
-        for j, (start, end) in enumerate(zip(slices[:-1], slices[1:])):
-            start_audio = start * sr
-            end_audio = end * sr
-            audio_slice = sound[int(start_audio) : int(end_audio)]
 
+        for j, (chunk, _) in enumerate(wav_slices(self.pcm, self.sampling_rate, 1000 * stream_duration)):
             clear_server_state = not self.is_speaking
             streaming_config = {"response_depth": self.task_sequence__intermediate_response_depth}
-            bytes_wav = bytes()
-            byte_io = io.BytesIO(bytes_wav)
-            write(byte_io, sr, audio_slice)
-            result_bytes = byte_io.read()
-
-            input_data = {"audio": [{"audioContent": base64.b64encode(result_bytes)}]}
+            input_data = {"audio": [{"audioContent": base64.b64encode(chunk)}]}
             print(f"Step {j}")
             self.socket_client.emit(
                 "data",